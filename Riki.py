@@ -6,7 +6,7 @@ import logging.config
 import os
 
 from config import LOGGING_CONFIG
-from wikiDB import wiki_db_setup, db_file_path
+from wikiDB import wiki_db_setup, wiki_db_upgrade, db_file_path
 
 from flask_sqlalchemy import SQLAlchemy
 from wiki import create_app
@@ -28,6 +28,8 @@ if __name__ == '__main__':
     #Check to see if the database exists, if not create the DB file
     if not os.path.exists(db_file):
         wiki_db_setup()
+    else:
+        wiki_db_upgrade()
 
     # Launch Wiki Web application
     app.run(host='0.0.0.0', debug=True)
\ No newline at end of file
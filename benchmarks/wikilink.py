@@ -0,0 +1,100 @@
+"""
+    Wikilink benchmark
+    ~~~~~~~~~~~~~~~~~~
+
+    Times wiki.core.wikilink on link heavy pages of growing size and
+    checks that the time per link stays flat, i.e. that the cost is
+    linear in the number of links. The previous implementation, which
+    rescanned the whole page once per link, is timed alongside it for
+    comparison.
+
+    Run from the repository root:
+
+        python -m benchmarks.wikilink [--sizes 250 500 1000 2000]
+"""
+import argparse
+import re
+import sys
+import time
+
+from wiki.core import clean_url
+from wiki.core import wikilink
+
+
+def url_formatter(endpoint, url):
+    return f'/{url}/'
+
+
+def quadratic_wikilink(text, url_formatter):
+    """
+        The implementation wikilink replaced: one re.sub over the whole
+        text per link.
+    """
+    link_regex = re.compile(
+        r"((?<!\<code\>)\[\[([^<].+?) \s*([|] \s* (.+?) \s*)?]])",
+        re.X | re.U
+    )
+    for i in link_regex.findall(text):
+        title = [i[-1] if i[-1] else i[1]][0]
+        url = clean_url(i[1])
+        html_url = "<a href='{0}'>{1}</a>".format(
+            url_formatter('wiki.display', url=url),
+            title
+        )
+        text = re.sub(link_regex, html_url, text, count=1)
+    return text
+
+
+def make_page(links):
+    """
+        Builds the html of a page with the given number of links, a
+        few of them repeated, among ordinary paragraphs.
+    """
+    paragraphs = []
+    for i in range(links):
+        target = f'Page {i % 50}' if i % 3 else f'Section/Sub page {i}'
+        link = f'[[{target}|Link {i}]]' if i % 2 else f'[[{target}]]'
+        paragraphs.append(f'<p>Some text before {link} and some after it.</p>')
+    return '\n'.join(paragraphs)
+
+
+def best_of(function, text, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(text, url_formatter)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[250, 500, 1000, 2000],
+                        help='numbers of links per page to time')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per size, the best one is kept')
+    parser.add_argument('--tolerance', type=float, default=2.0,
+                        help='largest allowed growth of the time per link between the smallest and largest page')
+    args = parser.parse_args(argv)
+
+    print(f"{'links':>8} {'single pass':>14} {'per link':>12} {'rescanning':>14} {'per link':>12}")
+    per_link = []
+    for size in args.sizes:
+        text = make_page(size)
+        if wikilink(text, url_formatter) != quadratic_wikilink(text, url_formatter):
+            print(f'Output differs from the previous implementation for {size} links')
+            return 1
+        linear = best_of(wikilink, text, args.repeat)
+        quadratic = best_of(quadratic_wikilink, text, 1)
+        per_link.append(linear / size)
+        print(f'{size:>8} {linear * 1000:>12.2f}ms {linear / size * 1e6:>10.2f}us '
+              f'{quadratic * 1000:>12.2f}ms {quadratic / size * 1e6:>10.2f}us')
+
+    growth = per_link[-1] / per_link[0]
+    print(f'Time per link grew {growth:.2f}x from {args.sizes[0]} to {args.sizes[-1]} links '
+          f'(tolerance {args.tolerance:.2f}x)')
+    return 0 if growth <= args.tolerance else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -9,7 +9,34 @@ CONTENT_DIR = f'{getcwd()}/content'
 USER_DIR = f'{getcwd()}/user'
 LOG_DIR = f'{getcwd()}/logs'
 NUMBER_OF_HISTORY = 5
+INDEX_PAGE_SIZE = 100  # pages per page of the index, tag and category listings
+MARKDOWN_POOL_SIZE = 16  # idle markdown converters kept per extension set
+WIKILINK_URL_CACHE_SIZE = 4096  # wiki link targets whose url is memoized
+ASSET_MAX_AGE = 365 * 24 * 3600  # seconds browsers may cache a fingerprinted static asset
+GZIP_MIN_SIZE = 1024  # smallest response body, in bytes, that is gzipped
+GZIP_LEVEL = 6  # compression level of gzipped responses
+GZIP_MIMETYPES = {'text/html', 'text/css', 'text/plain', 'application/json', 'application/javascript'}
+SEARCH_PAGE_SIZE = 20  # results per page of the search page
+SEARCH_MAX_PAGE_SIZE = 100  # largest page of results a client may ask for with ?size=
+SEARCH_SNIPPET_CONTEXT = 80  # characters of context shown on each side of a match in the snippet of a search result
+SEARCH_CACHE_SIZE = 128  # searches whose results are kept in memory, 0 to disable
+SEARCH_CACHE_MAX_BYTES = 32 * 1024 * 1024  # total size of the search results kept in memory
+SEARCH_CACHE_TTL = 300  # seconds the results of a search are reused for
+TYPEAHEAD_RESULTS = 10  # pages suggested by the title typeahead
+TYPEAHEAD_MAX_RESULTS = 50  # most pages a client may ask the title typeahead for with ?limit=
+TYPEAHEAD_INDEX_TTL = 300  # seconds before the title index is reloaded, picking up changes made by other processes
+REGEX_WORKERS = None  # processes scanning pages for a regex search, None for one per CPU
+REGEX_CHUNK_SIZE = 2000  # pages per task of a regex search
+REGEX_TIME_BUDGET = 5.0  # seconds a regex search may take before it is stopped
+REGEX_CPU_BUDGET = 2.0  # CPU seconds a worker may spend on one chunk of a regex search
+REGEX_CACHE_SIZE = 256  # compiled regex patterns kept per process
+RESPONSE_CACHE_SIZE = 256  # rendered pages kept for anonymous visitors, 0 to disable
+PREVIEW_SESSIONS = 64  # editing sessions whose last rendered preview blocks are kept
+HIGHLIGHT_CACHE_MAX_BYTES = 16 * 1024 * 1024  # total size of the highlighted code blocks kept in memory
+WARMUP_WORKERS = None  # processes used by warm_cache.py, None for one per CPU
+WARMUP_BATCH_SIZE = 100  # pages per render task and per write transaction in warm_cache.py
 PRIVATE = True
+ADMIN_USERS = []  # names of the users allowed on the /admin/ pages, e.g. ['root']
 LOG_LEVEL = 'DEBUG' #Should be set to INFO in prod
 LOGGING_CONFIG = {
     'version': 1,
@@ -79,4 +106,25 @@ LOGGING_CONFIG = {
     }
 }
 TEXT_ENCODING = "UTF-8"
+# Database connection pool
+DB_POOL_SIZE = 8  # maximum number of connections open at once
+DB_POOL_TIMEOUT = 30  # seconds to wait for a free connection
+DB_POOL_HEALTH_CHECK_INTERVAL = 60  # seconds a connection may idle before it is checked again
+DB_STATEMENT_CACHE_SIZE = 256  # prepared statements kept per pooled connection
+DB_QUERY_TEMPLATE_CACHE_SIZE = 512  # compiled query templates shared by all connections
+DB_BULK_CHUNK_SIZE = 1000  # rows per executemany call in insert_many/update_many
+DB_STREAM_BATCH_SIZE = 256  # rows fetched per round trip by Query.stream
+DB_SLOW_QUERY_MS = 100  # statements slower than this are logged as slow
+DB_EXPLAIN_SLOW_QUERIES = True  # capture EXPLAIN QUERY PLAN for slow statements
+DB_SLOW_QUERY_LOG_SIZE = 100  # slow statements kept for the admin stats endpoint
+# Pragmas applied, in order, when the database is set up and to every pooled connection
+DB_PRAGMAS = {
+    'busy_timeout': 20000,  # milliseconds to wait on a locked database before failing
+    'journal_mode': 'WAL',  # readers never wait on the single writer
+    'synchronous': 'NORMAL',  # safe with WAL, only the last transactions can be lost on power failure
+    'foreign_keys': 'ON',
+    'cache_size': -16384,  # negative values are in KiB
+    'mmap_size': 268435456,  # bytes
+    'temp_store': 'MEMORY',
+}
 
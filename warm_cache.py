@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+    Render cache warmup
+    ~~~~~~~~~~~~~~~~~~~
+
+    Re-renders every page of the wiki and stores the results in the
+    RENDER_KEY and RENDERED columns of PAGE, so the cost of a renderer
+    or extension upgrade is not paid by the first visitor of each page.
+
+    Pages are rendered across a pool of processes, markdown and
+    pygments being CPU bound, and written back in batched
+    transactions. Pages whose cached render is already current are
+    skipped unless --force is given.
+
+    Run from the directory holding wiki.db and config.py:
+
+        python warm_cache.py [--workers N] [--batch-size N] [--force]
+"""
+import argparse
+import logging
+import logging.config
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+import config
+from config import LOGGING_CONFIG
+from wikiDB import wiki_db_upgrade, db_file_path
+from wikiDB.tables import PageTable
+
+log = logging.getLogger('wiki')
+
+
+def init_worker(directory):
+    """
+        Gives a worker process an application and a request context,
+        which the wiki link postprocessor needs to build urls.
+    """
+    global _context
+    from wiki import create_app
+    app = create_app(directory)
+    _context = app.test_request_context()
+    _context.push()
+
+
+def render_batch(rows):
+    """
+        Renders a batch of pages.
+
+        :param list rows: the ID and content of every page to render.
+
+        :returns: the rows to update, with the new RENDER_KEY and
+            RENDERED of every page.
+        :rtype: list
+    """
+    from wiki.core import Processor, render_key, serialize_render
+    rendered = []
+    for id, content in rows:
+        try:
+            html, body, meta = Processor(content).process()
+        except Exception:
+            log.exception(f'Unable to render page {id}')
+            continue
+        rendered.append({'ID': id, 'render_key': render_key(content), 'rendered': serialize_render(html, body, meta)})
+    return rendered
+
+
+def batches(force, batch_size):
+    """
+        Streams the pages to render, in batches of ID and content.
+    """
+    from wiki.core import render_key
+    batch = []
+    for id, content, key in PageTable.select(ID=True, content=True, render_key=True).stream():
+        content = content.decode(config.TEXT_ENCODING) if isinstance(content, bytes) else content
+        if not force and key == render_key(content):
+            continue
+        batch.append((id, content))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def warm(workers=None, batch_size=None, force=False, directory=None):
+    """
+        Renders the pages of the wiki and writes the results back.
+
+        :returns: the number of pages rendered and written.
+        :rtype: int
+    """
+    workers = workers or config.WARMUP_WORKERS or os.cpu_count()
+    batch_size = batch_size or config.WARMUP_BATCH_SIZE
+    directory = directory or os.getcwd()
+    total = PageTable.Query(PageTable.name(), "SELECT", "COUNT(*)").exec()[0][0]
+    log.info(f'Warming the render cache of {total} pages with {workers} workers')
+
+    start = time.perf_counter()
+    rendered = written = 0
+    # The rows are streamed on this thread's connection for the whole run, so the batches are written from another
+    # thread, which holds its own connection and commits each batch on its own.
+    writer = ThreadPoolExecutor(max_workers=1)
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=init_worker, initargs=(directory,)) as pool:
+        pending, writes = set(), []
+
+        def collect(done):
+            nonlocal rendered
+            for future in done:
+                rows = future.result()
+                rendered += len(rows)
+                writes.append(writer.submit(PageTable.update_many, rows))
+            elapsed = time.perf_counter() - start
+            print(f'\rRendered {rendered}/{total} pages, {rendered / elapsed:.1f} pages/s', end='', flush=True)
+
+        for batch in batches(force, batch_size):
+            pending.add(pool.submit(render_batch, batch))
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+        collect(wait(pending).done)
+
+    writer.shutdown(wait=True)
+    for write in writes:
+        count = write.result()
+        if count < 0:
+            log.error('Unable to write a batch of rendered pages')
+        else:
+            written += count
+    elapsed = time.perf_counter() - start
+    print(f'\rRendered {rendered}/{total} pages and wrote {written} in {elapsed:.1f}s '
+          f'({rendered / elapsed if elapsed else 0:.1f} pages/s)')
+    log.info(f'Render cache warmed: {written} pages written in {elapsed:.1f}s')
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=None,
+                        help='render processes, defaults to WARMUP_WORKERS or one per CPU')
+    parser.add_argument('--batch-size', type=int, default=None,
+                        help='pages per render task and write transaction, defaults to WARMUP_BATCH_SIZE')
+    parser.add_argument('--force', action='store_true', help='re-render pages whose cached render is current')
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(db_file_path()):
+        print(f'No wiki database at {db_file_path()}')
+        return 1
+    wiki_db_upgrade()
+    warm(args.workers, args.batch_size, args.force)
+    return 0
+
+
+if __name__ == '__main__':
+    logging.config.dictConfig(LOGGING_CONFIG)
+    sys.exit(main())
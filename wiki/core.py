@@ -5,12 +5,18 @@
     Responsible for presenting information to the user
 
 """
+import base64
+import hashlib
 import json
 import logging
-from collections import OrderedDict
+from collections import OrderedDict, namedtuple
+from itertools import islice
 from io import open
 import os
 import re
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
 
 from flask import abort
 from flask import url_for
@@ -18,10 +24,17 @@ import markdown
 import datetime
 
 import config
-from wikiDB.tables import PageTable
+from wiki import highlight
+from wiki.search import snippet_html
+from wikiDB.tables import PageTable, PageSearchTable
 log_wiki = logging.getLogger('wiki')
 log_db = logging.getLogger('database')
 
+# Version of the rendering pipeline, part of the key of cached renders
+RENDERER_VERSION = 1
+
+highlight.install()
+
 def clean_url(url):
     """
         Cleans the url and corrects various errors. Removes multiple
@@ -43,6 +56,24 @@ def clean_url(url):
     return url
 
 
+WIKILINK_REGEX = re.compile(
+    r"((?<!\<code\>)\[\[([^<].+?) \s*([|] \s* (.+?) \s*)?]])",
+    re.X | re.U
+)
+
+
+@lru_cache(maxsize=config.WIKILINK_URL_CACHE_SIZE)
+def _wikilink_url(url_formatter, target):
+    """
+        Builds the url a wiki link points to. Memoized, as the same
+        targets are linked over and over.
+
+        :param function url_formatter: the URL formatter to use
+        :param str target: the link target as written in the page
+    """
+    return url_formatter('wiki.display', url=clean_url(target))
+
+
 def wikilink(text, url_formatter=None):
     """
         Processes Wikilink syntax "[[Link]]" within the html body.
@@ -59,29 +90,307 @@ def wikilink(text, url_formatter=None):
             base location "/", therefore sub-pages need to use the
             [[page/subpage|Subpage]].
 
+        All links are replaced in a single pass over the html, so the
+        cost is linear in its length whatever the number of links.
+
         :returns: the processed html
         :rtype: str
     """
-    log_wiki.debug(f'Preformatted wiki-link: \'{text}\'')
     if url_formatter is None:
         url_formatter = url_for
-    link_regex = re.compile(
-        r"((?<!\<code\>)\[\[([^<].+?) \s*([|] \s* (.+?) \s*)?]])",
-        re.X | re.U
-    )
-    for i in link_regex.findall(text):
-        title = [i[-1] if i[-1] else i[1]][0]
-        url = clean_url(i[1])
-        html_url = "<a href='{0}'>{1}</a>".format(
-            url_formatter('wiki.display', url=url),
-            title
-        )
-        text = re.sub(link_regex, html_url, text, count=1)
-
-    log_wiki.debug(f'Formatted wiki-link: \'{text}\'')
+
+    def link(match):
+        title = match.group(4) or match.group(2)
+        return "<a href='{0}'>{1}</a>".format(_wikilink_url(url_formatter, match.group(2)), title)
+
+    text, count = WIKILINK_REGEX.subn(link, text)
+    log_wiki.debug(f'Formatted {count} wiki-links')
     return text
 
 
+def encode_position(values):
+    """
+        Encodes the sort key of the last item of a page of results into
+        an opaque, url safe cursor.
+
+        :param list values: the values of the sort key
+
+        :returns: the cursor
+        :rtype: str
+    """
+    position = json.dumps(list(values))
+    return base64.urlsafe_b64encode(position.encode(config.TEXT_ENCODING)).decode('ascii')
+
+
+def decode_position(cursor, count):
+    """
+        Decodes a cursor made by :func:`encode_position`. An invalid
+        cursor aborts the request with a 400.
+
+        :param str cursor: the cursor, or None
+        :param int count: the number of values of the sort key
+
+        :returns: the values of the sort key, or None
+        :rtype: tuple
+    """
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode(config.TEXT_ENCODING))
+    except (ValueError, TypeError):
+        values = None
+    if not isinstance(values, list) or len(values) != count:
+        log_wiki.debug(f'Invalid cursor: \'{cursor}\'')
+        abort(400)
+    return tuple(values)
+
+
+def encode_cursor(page):
+    """
+        Encodes the position of a page in the title ordered index
+        into an opaque, url safe cursor.
+
+        :param Page page: the last page of an index page
+
+        :returns: the cursor
+        :rtype: str
+    """
+    return encode_position([page.notTheOtherTitle, page.id])
+
+
+def decode_cursor(cursor):
+    """
+        Decodes a cursor made by :func:`encode_cursor`.
+
+        :param str cursor: the cursor, or None
+
+        :returns: the (title, id) to continue after, or None
+        :rtype: tuple
+    """
+    return decode_position(cursor, 2)
+
+
+def render_key(text):
+    """
+        Computes the key a render of the given text is cached under.
+        It changes with the text as well as with the renderer, so
+        bump RENDERER_VERSION whenever a change to the processing
+        changes its output.
+
+        :param str text: the text to render
+
+        :returns: the cache key
+        :rtype: str
+    """
+    digest = hashlib.sha256(f'{RENDERER_VERSION}:{markdown.version}\n'.encode(config.TEXT_ENCODING))
+    digest.update(text.encode(config.TEXT_ENCODING))
+    return digest.hexdigest()
+
+
+# A search result; rank is only set by the full-text search, snippet is the highlighted passage that matched as html
+SearchResult = namedtuple('SearchResult', ['id', 'uri', 'title', 'date_created', 'last_edited', 'rank', 'snippet'],
+                          defaults=(None, None))
+
+# The ORDER BY terms of the sort options of the search page
+SEARCH_ORDERS = {
+    'default': ("RANK", "ID"),
+    'CDO': ("DATE_CREATED", "ID"),
+    'CDN': ("DATE_CREATED DESC", "ID DESC"),
+    'EDO': ("LAST_EDITED", "ID"),
+    'EDN': ("LAST_EDITED DESC", "ID DESC")
+}
+# The results of regex and substring searches have no rank, by default they are listed in the order of the pages
+SCAN_ORDERS = dict(SEARCH_ORDERS, default=("ID",))
+
+SEARCH_TERM_REGEX = re.compile(r'"([^"]*)"|(\S+)')
+# Anything that makes the search text a regular expression rather than words and phrases
+REGEX_SYNTAX_REGEX = re.compile(r'[\\^$.|?+()\[\]{}]|\*(?=\S)')
+
+
+# A tag is only in the full-text index if it holds a word
+TAG_WORD_REGEX = re.compile(r'[^\W_]')
+
+
+def page_tags(page):
+    """
+        :returns: the tags of a page, as listed on the tags page.
+        :rtype: list
+    """
+    return [tag.strip() for tag in page.tags.split(',')]
+
+
+def is_plain_search(text):
+    """
+        Tells whether a search text is only words, "quoted phrases"
+        and prefixes (word*), which the full-text index can answer,
+        rather than a regular expression.
+    """
+    return REGEX_SYNTAX_REGEX.search(text) is None
+
+
+def fts_query(text):
+    """
+        Turns a search text into an FTS5 query matching the pages that
+        hold every word, "quoted phrase" and prefix (word*) of it.
+        Every term is quoted, so the FTS5 operators and column filters
+        are never interpreted.
+
+        :param str text: the search text
+
+        :returns: the FTS5 query, empty if there is nothing to search
+        :rtype: str
+    """
+    terms = []
+    for phrase, word in SEARCH_TERM_REGEX.findall(text):
+        if phrase.strip():
+            terms.append(f'"{phrase}"')
+        elif word:
+            prefix = word.endswith('*')
+            word = word.rstrip('*').replace('"', '""')
+            if word:
+                terms.append(f'"{word}"*' if prefix else f'"{word}"')
+    return ' '.join(terms)
+
+
+_listeners = []
+_generation = 0
+_generation_lock = threading.Lock()
+
+
+def add_listener(listener):
+    """
+        Registers a function to be told about every change to the
+        pages of the wiki. It is called as listener(event, url,
+        **details) once the change is stored, with event one of
+        'save' (with title), 'move' (with newurl) or 'delete'.
+
+        :param function listener: the function to call
+    """
+    _listeners.append(listener)
+
+
+def write_generation():
+    """
+        :returns: the number of changes made to the pages by this
+            process so far. Anything computed from the pages is current
+            for as long as the generation it was computed at is.
+    """
+    return _generation
+
+
+def notify(event, url, **details):
+    """
+        Bumps the write generation and tells the registered listeners
+        about a change to a page. A failing listener is logged and does
+        not stop the others.
+    """
+    global _generation
+    with _generation_lock:
+        _generation += 1
+    for listener in list(_listeners):
+        try:
+            listener(event, url, **details)
+        except Exception:
+            log_wiki.exception(f'Listener failed on {event} of page \'{url}\'')
+
+
+class MarkdownPool(object):
+    """
+        A thread safe pool of configured markdown.Markdown converters.
+
+        Building a converter and its extensions is a large part of the
+        cost of rendering a page, so converters are kept on a free list
+        per extension set and reset between uses instead.
+    """
+
+    def __init__(self, max_idle=None):
+        """
+            :param int max_idle: the number of idle converters kept per
+                extension set, defaults to MARKDOWN_POOL_SIZE.
+        """
+        self.max_idle = config.MARKDOWN_POOL_SIZE if max_idle is None else max_idle
+        self._lock = threading.Lock()
+        self._idle = {}
+        self.created = 0
+        self.reused = 0
+
+    @contextmanager
+    def converter(self, extensions):
+        """
+            Lends a converter for the duration of the with-block.
+
+            :param extensions: the names of the markdown extensions
+                the converter is configured with.
+        """
+        key = tuple(extensions)
+        with self._lock:
+            idle = self._idle.get(key)
+            md = idle.pop() if idle else None
+            if md is None:
+                self.created += 1
+            else:
+                self.reused += 1
+        if md is None:
+            md = markdown.Markdown(extensions=list(key))
+        try:
+            yield md
+        finally:
+            md.reset()
+            with self._lock:
+                idle = self._idle.setdefault(key, [])
+                if len(idle) < self.max_idle:
+                    idle.append(md)
+
+    def stats(self):
+        """
+            :returns: the number of converters created and reused, and
+                the number idle per extension set.
+            :rtype: dict
+        """
+        with self._lock:
+            return {
+                'created': self.created,
+                'reused': self.reused,
+                'idle': {', '.join(key): len(idle) for key, idle in self._idle.items()}
+            }
+
+
+markdown_pool = MarkdownPool()
+
+
+META_REGEX = re.compile(r'^[ ]{0,3}(?P<key>[A-Za-z0-9_-]+):\s*(?P<value>.*)')
+META_MORE_REGEX = re.compile(r'^[ ]{4,}(?P<value>.*)')
+
+
+def parse_meta(text):
+    """
+        Reads the meta data of a page from its "key: value" lines
+        before the first blank line, the way the markdown meta
+        extension does, but without rendering anything. Gives the
+        same meta data as :meth:`Processor.process`.
+
+        :param str text: the content of a page, or just its header.
+
+        :returns: the meta data, in the order of the header
+        :rtype: OrderedDict
+    """
+    meta = OrderedDict()
+    key = None
+    for line in text.split('\n\n', 1)[0].split('\n'):
+        match = META_REGEX.match(line)
+        if match:
+            key = match.group('key').lower()
+            value = match.group('value').strip()
+            meta[key] = f"{meta[key]}\n{value}" if key in meta else value
+            continue
+        match = META_MORE_REGEX.match(line)
+        if match and key is not None:
+            meta[key] = f"{meta[key]}\n{match.group('value').strip()}"
+        else:
+            break
+    return meta
+
+
 class Processor(object):
     """
         The processor handles the processing of file content into
@@ -91,6 +400,12 @@ class Processor(object):
         cases.
     """
 
+    extensions = [
+        'codehilite',
+        'fenced_code',
+        'meta',
+        'tables'
+    ]
     preprocessors = []
     postprocessors = [wikilink]
 
@@ -100,17 +415,10 @@ class Processor(object):
 
             :param str text: the text to process
         """
-
-
-        self.md = markdown.Markdown([
-            'codehilite',
-            'fenced_code',
-            'meta',
-            'tables'
-        ])
         self.input = text
         self.markdown = None
         self.meta_raw = None
+        self.md_meta = None
 
         self.pre = None
         self.html = None
@@ -130,7 +438,9 @@ class Processor(object):
         """
             Convert to HTML.
         """
-        self.html = self.md.convert(self.pre)
+        with markdown_pool.converter(self.extensions) as md:
+            self.html = md.convert(self.pre)
+            self.md_meta = getattr(md, 'Meta', {})
 
 
     def split_raw(self):
@@ -155,7 +465,7 @@ class Processor(object):
             # markdown metadata always returns a list of lines, we will
             # reverse that here
             self.meta[key.lower()] = \
-                '\n'.join(self.md.Meta[key.lower()])
+                '\n'.join(self.md_meta[key.lower()])
 
     def process_post(self):
         """
@@ -181,18 +491,48 @@ class Processor(object):
         return self.final, self.markdown, self.meta
 
 
+def serialize_render(html, body, meta):
+    """
+        Serializes the output of :meth:`Processor.process` into the
+        RENDERED column of a page.
+
+        :returns: the serialized render
+        :rtype: str
+    """
+    return json.dumps([html, body, list(meta.items())])
+
+
 class Page(object):
 
-    def __init__(self, id, url, title, content, date_created, last_edited, new=False):
+    def __init__(self, id, url, title, content, date_created, last_edited, new=False, render_cache=None,
+                 header=None):
+        """
+            A page of the wiki. Rendering is deferred until the html,
+            body or meta data is first needed, and if content is None
+            it is only loaded from the DB on first access, so summary
+            listings never touch either.
+
+            :param tuple render_cache: the RENDER_KEY and RENDERED
+                columns of the page, reused instead of rendering when
+                they were made from the same content.
+            :param str header: the meta data block of the page, read
+                for its title and tags instead of the whole content.
+        """
         self.id = id
         self.url = url
         self.notTheOtherTitle = title
-        self.content = content if not isinstance(content, bytes) else content.decode("UTF-8")
+        self._content = content if not isinstance(content, bytes) else content.decode(config.TEXT_ENCODING)
         self.date_created = date_created
         self.last_edited = last_edited
         self._meta = OrderedDict()
-        if not new:
-            self.render()
+        self._html = None
+        self._body = None
+        self._rendered = new
+        self._stored = not new
+        self._render_cache = tuple(render_cache) if render_cache and render_cache[0] else None
+        if isinstance(header, bytes):
+            header = header.decode(config.TEXT_ENCODING)
+        self._header = parse_meta(header) if header is not None else None
 
     def __repr__(self):
         return "<Page: {}@{}>".format(self.url, self.path)
@@ -209,61 +549,117 @@ class Page(object):
 
 
 
-    def render(self):
+    @property
+    def content(self):
+        if self._content is None:
+            result = PageTable.select(content=True).where(ID=self.id).exec()
+            if len(result) == 0:
+                log_db.error(f'Unable to load content of page with url: \'{self.url}\'')
+                self._content = ""
+            else:
+                self._content = result[0][0].decode(config.TEXT_ENCODING)
+        return self._content
+
+    @content.setter
+    def content(self, value):
+        self._content = value
+        self._header = None
+
+    def _header_meta(self):
+        """
+            The meta data of the page, from the rendered page if there
+            is one, and otherwise parsed from the header alone.
+        """
+        if self._rendered:
+            return self._meta
+        if self._header is None:
+            self._header = parse_meta(self.content)
+        return self._header
+
+    def _process(self):
+        """
+            Renders the content, unless the cached render was made
+            from the same content by the same renderer.
+
+            :returns: True if the content had to be rendered
+        """
+        key = render_key(self.content)
+        if self._render_cache is not None and self._render_cache[0] == key:
+            html, body, meta = json.loads(self._render_cache[1])
+            self._html, self._body, self._meta = html, body, OrderedDict(meta)
+            self._rendered = True
+            return False
         processor = Processor(self.content)
-        self._html, self.body, self._meta = processor.process()
+        self._html, self._body, self._meta = processor.process()
+        self._render_cache = (key, serialize_render(self._html, self._body, self._meta))
+        self._rendered = True
+        return True
+
+    def render(self):
+        if self._process() and self._stored:
+            # fill the cache of a page that was stored without one
+            PageTable.update(render_key=self._render_cache[0], rendered=self._render_cache[1])\
+                .where(ID=self.id)\
+                .exec()
+
+    def _render_once(self):
+        if not self._rendered:
+            self.render()
 
     def save(self, update=True):
         """
-        First checks if a page already exists in the DB, and if so, updates that page.
-        Otherwise creates a new page entry with this object.
-        @param update: True if the page should be rendered upon completion of the save.
+        Inserts this page into the DB, or updates the page already at its url, in a single statement.
+        @param update: True if the page should be rendered, and the render cached, along with the save.
         @return:
         """
         now = datetime.datetime.now()
         lines = []
-        for key, value in list(self._meta.items()):
+        for key, value in list(self.meta.items()):
             line = '%s: %s\n' % (key, value)
             lines.append(line)
             log_wiki.debug(f'line: \'{line}\'')
 
 
-        #PageTable.insert(self.url, self.title, bytes(self.content, "UTF-8"), now, now).exec()
-
-        if len(PageTable.select(URI=True).where(separator="OR", URI=self.url).exec()) != 0:
-            PageTable\
-                .update(title=self.title, content=bytes(self.content, config.TEXT_ENCODING), last_edited=now)\
-                .where(separator="OR", URI=self.url)\
-                .exec()
-        else:
-            PageTable.insert(self.url, self.title, bytes(self.content, config.TEXT_ENCODING), now, now).exec()
-
+        key, rendered = None, None
         if update:
-            self.render()
+            self._process()
+            key, rendered = self._render_cache
+
+        PageTable.upsert(self.url, self.title, bytes(self.content, config.TEXT_ENCODING), now, now,
+                         key, rendered).exec()
+        notify('save', self.url, title=self.title)
 
     @property
     def meta(self):
+        self._render_once()
         return self._meta
 
     def __getitem__(self, name):
+        self._render_once()
         return self._meta[name]
 
     def __setitem__(self, name, value):
+        self._render_once()
         self._meta[name] = value
 
     @property
     def html(self):
+        self._render_once()
         return self._html
 
+    @property
+    def body(self):
+        self._render_once()
+        return self._body
+
     def __html__(self):
         return self.html
 
     @property
     def title(self):
-        try:
-            return self['title']
-        except KeyError:
-            return self.url
+        if not self._rendered and self.notTheOtherTitle:
+            return self.notTheOtherTitle
+        return self._header_meta().get('title', self.url)
 
     @title.setter
     def title(self, value):
@@ -271,10 +667,7 @@ class Page(object):
 
     @property
     def tags(self):
-        try:
-            return self['tags']
-        except KeyError:
-            return ""
+        return self._header_meta().get('tags', "")
 
     @tags.setter
     def tags(self, value):
@@ -306,7 +699,30 @@ class Wiki(object):
             content = result[3]
             date_created = result[4]
             last_edited = result[5]
-            return Page(id, uri, title, content, date_created, last_edited)
+            render_cache = result[6:8]
+            return Page(id, uri, title, content, date_created, last_edited, render_cache=render_cache)
+
+    def get_version(self, url):
+        """
+            Gets what identifies the current version of a page without
+            loading or rendering it: when it was last edited and the
+            hash of its content (its RENDER_KEY, computed from the
+            content if the page was never rendered).
+
+            :param str url: the url of the page
+
+            :returns: the last edited date and content hash, or None
+                if there is no page at the url.
+            :rtype: tuple
+        """
+        result = PageTable.select(ID=True, last_edited=True, render_key=True).where(URI=url).exec()
+        if len(result) != 1:
+            return None
+        id, last_edited, key = result[0]
+        if key is None:
+            content = PageTable.select(content=True).where(ID=id).exec()[0][0]
+            key = render_key(content.decode(config.TEXT_ENCODING))
+        return last_edited, key
 
     def path(self, url):
         return os.path.join(self.root, url + '.md')
@@ -317,7 +733,7 @@ class Wiki(object):
         @param url: The url of the page in question
         @return: True if the page exists in the DB
         """
-        result_list = PageTable.select().where('OR',URI=url,title=url).exec()
+        result_list = PageTable.select(ID=True).where('OR',URI=url,title=url).exec()
         return len(result_list) > 0
 
 
@@ -333,7 +749,8 @@ class Wiki(object):
                 returned_tup[2],  # TITLE
                 returned_tup[3],  # CONTENT
                 returned_tup[4],  # DATE CREATED
-                returned_tup[5]   # LAST EDITED
+                returned_tup[5],  # LAST EDITED
+                render_cache=returned_tup[6:8]  # RENDER KEY, RENDERED
             )
         return None
 
@@ -345,7 +762,7 @@ class Wiki(object):
         """
         if self.exists(url):
             return False
-        id = len(PageTable.select().exec()) + 1
+        id = len(PageTable.select(ID=True).exec()) + 1
         log_wiki.info(f'created page with ID= \'{id}\'')
         page = Page(id, url, "", "", "", "", new=True)
         return page
@@ -357,13 +774,14 @@ class Wiki(object):
         @param newurl: the destination url
         @return:
         """
-        if (PageTable.select().where("", URI=newurl).exec()):
+        if (PageTable.select(ID=True).where("", URI=newurl).exec()):
             msg = f'Cannot move page to url \'{newurl}\' as it already exists'
             log_wiki.error(msg)
             raise ValueError(msg)
         else:
             log_wiki.info(f'Moved page from url: \'{url}\' to url: \'{newurl}\'')
             PageTable.update(URI=newurl).where("", URI=url).exec()
+            notify('move', url, newurl=newurl)
 
 
     def delete(self, url):
@@ -375,27 +793,143 @@ class Wiki(object):
         log_wiki.info(f'Deleting page with url: \'{url}\'')
         if(PageTable.select().where("", URI=url).exec):
             PageTable.delete().where("", URI=url).exec()
+            notify('delete', url)
             log_wiki.info('Page deleted.')
             return True
         log_wiki.info("Page did not exist.")
         return False
 
 
-    def index(self):
+    def _iter_index(self, with_content=False, after=None, with_header=False):
+        """
+            Streams the available pages ordered by title, using the
+            IX_PAGE_TITLE_NOCASE index.
+
+            :param bool with_content: fetch the content of every page
+                in the same query.
+            :param tuple after: the (title, id) of the page to continue
+                after.
+            :param bool with_header: fetch only the meta data block of
+                every page, enough for its title and tags.
+        """
+        with_header = with_header and not with_content
+        query = PageTable.select(ID=True, URI=True, title=True, content=with_content, date_created=True,
+                                 last_edited=True, render_key=with_content, rendered=with_content,
+                                 header=with_header)\
+            .order_by("TITLE COLLATE NOCASE", "ID")
+        if after is not None:
+            query.after(*after)
+        for row in query.stream():
+            if with_content:
+                yield Page(*row[:6], render_cache=row[6:])
+            elif with_header:
+                yield Page(*row[:3], None, *row[3:5], header=row[5])
+            else:
+                yield Page(*row[:3], None, *row[3:])
+
+    def _iter_tagged(self, tag, after=None):
+        """
+            Streams the pages tagged with <tag> ordered by title. The
+            TAGS column of the full-text index finds the pages whose
+            tags hold the words of the tag, sorted and seeked on their
+            title in SQL; only those pages are read and checked for the
+            tag itself, so listing a tag costs as much as the pages
+            carrying it rather than the whole wiki.
+
+            :param str tag: the tag, one of the comma separated tags of
+                a page.
+            :param tuple after: the (title, id) of the page to continue
+                after.
+        """
+        if not TAG_WORD_REGEX.search(tag):
+            # a tag without words is not in the full-text index
+            yield from (page for page in self._iter_index(False, after, True) if tag in page_tags(page))
+            return
+        match = 'TAGS : "{}"'.format(tag.replace('"', '""'))
+        batch = config.INDEX_PAGE_SIZE + 1
+        while True:
+            query = PageSearchTable.select(ID=True, title=True).where(MATCHES=match)\
+                .order_by("TITLE COLLATE NOCASE", "ID")
+            if after is not None:
+                query.after(*after)
+            rows = query.limit(batch).exec()
+            if rows == -1:
+                log_db.error(f'Unable to list the pages tagged \'{tag}\'')
+                return
+            for id, _ in rows:
+                page = self._get_header(id)
+                if page is not None and tag in page_tags(page):
+                    yield page
+            if len(rows) < batch:
+                return
+            after = (rows[-1][1], rows[-1][0])
+
+    def _get_header(self, id):
+        """
+            :returns: the page with the given ID, with only the meta
+                data block of its content, or None if there is none.
+        """
+        rows = PageTable.select(ID=True, URI=True, title=True, date_created=True, last_edited=True, header=True)\
+            .where(ID=id).exec()
+        if not rows or rows == -1:
+            return None
+        row = rows[0]
+        return Page(*row[:3], None, *row[3:5], header=row[5])
+
+    def index(self, with_content=False, with_header=False):
         """
             Builds up a list of all the available pages.
 
+            Only the summary columns are fetched by default; the
+            content of a page is then loaded, and rendered, on first
+            access.
+
+            :param bool with_content: fetch the content of every page
+                in the same query, for callers that need all of it.
+            :param bool with_header: fetch only the meta data block of
+                every page, for callers that need the titles and tags.
+
             :returns: a list of all the wiki pages
             :rtype: list
         """
 
-        pages = []
-        result_list = PageTable.select().exec()
-        log_wiki.debug(f'Num pages on index call: {len(result_list)}')
-        for id, uri, title, content, date_created, last_edited in result_list:
-            pages.append(Page(id, uri, title, content, date_created, last_edited))
-        return sorted(pages, key=lambda x: x.title.lower())
+        pages = list(self._iter_index(with_content, with_header=with_header))
+        log_wiki.debug(f'Num pages on index call: {len(pages)}')
+        return pages
 
+    def index_page(self, cursor=None, size=None, with_content=False, tag=None, with_header=False):
+        """
+            Gets a single page of the index. Pages are fetched with a
+            keyset seek from the cursor, so every index page costs
+            the same however far into the wiki it is. A tag listing
+            costs as much as the pages carrying the tag, see
+            :meth:`_iter_tagged`.
+
+            :param str cursor: the cursor returned along with the
+                previous index page, or None for the first one.
+            :param int size: the number of pages per index page,
+                defaults to INDEX_PAGE_SIZE.
+            :param bool with_content: fetch the content of the pages
+                in the same query.
+            :param str tag: only list the pages with this tag among
+                their comma separated tags.
+            :param bool with_header: fetch only the meta data block of
+                the pages in the same query.
+
+            :returns: the wiki pages, and the cursor of the next index
+                page or None if this is the last one.
+            :rtype: tuple
+        """
+        if size is None:
+            size = config.INDEX_PAGE_SIZE
+        if tag is not None:
+            pages = self._iter_tagged(tag, decode_cursor(cursor))
+        else:
+            pages = self._iter_index(with_content, decode_cursor(cursor), with_header)
+        pages = list(islice(pages, size + 1))
+        if len(pages) > size:
+            return pages[:size], encode_cursor(pages[size - 1])
+        return pages, None
 
     def index_by(self, key):
         """
@@ -421,8 +955,9 @@ class Wiki(object):
         pages = self.index(attr='title')
         return pages.get(title)
 
-    def get_tags(self):
-        pages = self.index()
+    def get_tags(self, pages=None):
+        if pages is None:
+            pages = self.index(with_header=True)
         tags = {}
         for page in pages:
             pagetags = page.tags.split(',')
@@ -437,15 +972,120 @@ class Wiki(object):
         return tags
 
     def index_by_tag(self, tag):
-        pages = self.index()
+        pages = self.index(with_header=True)
         tagged = []
         for page in pages:
             if tag in page.tags:
                 tagged.append(page)
-        return sorted(tagged, key=lambda x: x.title.lower())
+        return tagged
+
+    def search_text(self, text, option='default', cursor=None, size=None):
+        """
+            Gets a page of the results of a search of the title, tags
+            and body of the pages through the full-text index, each
+            with a highlighted snippet of the passage that matched.
+
+            :param str text: the words, "quoted phrases" and prefixes
+                (word*) to look for, see :func:`fts_query`.
+            :param str option: the sort option, a key of SEARCH_ORDERS.
+                'default' ranks the pages by relevance (bm25).
+            :param str cursor: the cursor returned along with the
+                previous page of results, or None for the first one.
+            :param int size: the number of results per page, defaults
+                to SEARCH_PAGE_SIZE.
+
+            :returns: the matching pages, and the cursor of the next
+                page of results or None if this is the last one.
+            :rtype: tuple
+        """
+        query = fts_query(text)
+        if not query:
+            return [], None
+        if size is None:
+            size = config.SEARCH_PAGE_SIZE
+        order = SEARCH_ORDERS.get(option, SEARCH_ORDERS['default'])
+        select = PageSearchTable.select(ID=True, URI=True, title=True, date_created=True, last_edited=True,
+                                        rank=True)\
+            .where(MATCHES=query)\
+            .order_by(*order)
+        after = decode_position(cursor, len(order))
+        if after is not None:
+            select.after(*after)
+        rows = select.limit(size + 1).exec()
+        if rows == -1:
+            log_db.error(f'Full-text search failed for query: \'{query}\'')
+            return [], None
+
+        results = []
+        for row in rows[:size]:
+            # only the snippets of the results shown are computed
+            snippet = PageSearchTable.select(snippet=True).where('AND', MATCHES=query, ID=row[0]).exec()
+            snippet = snippet[0][0] if snippet and snippet != -1 else None
+            results.append(SearchResult(*row, snippet=snippet_html(snippet)))
+        return results, self._next_cursor(results, order, len(rows) > size)
+
+    def search_pages(self, ids, option='default', cursor=None, size=None, snippet=None):
+        """
+            Gets a page of the results of a regex or substring search.
+            The matching pages are sorted, seeked from the cursor and
+            cut in a single query over those pages only, so a page of
+            results costs as much as the matches rather than the wiki,
+            and only the pages of the result page are loaded.
+
+            :param array ids: the IDs of the matching pages.
+            :param str option: the sort option, a key of SCAN_ORDERS.
+            :param str cursor: the cursor returned along with the
+                previous page of results, or None for the first one.
+            :param int size: the number of results per page, defaults
+                to SEARCH_PAGE_SIZE.
+            :param function snippet: builds the highlighted snippet of
+                a page from its title and content.
+
+            :returns: the matching pages, and the cursor of the next
+                page of results or None if this is the last one.
+            :rtype: tuple
+        """
+        if not len(ids):
+            return [], None
+        if size is None:
+            size = config.SEARCH_PAGE_SIZE
+        order = SCAN_ORDERS.get(option, SCAN_ORDERS['default'])
+        keys = [term.split()[0] for term in order]
+        select = PageTable.select(ID=True, date_created="DATE_CREATED" in keys, last_edited="LAST_EDITED" in keys)\
+            .where_in("ID", ids)\
+            .order_by(*order)
+        after = decode_position(cursor, len(order))
+        if after is not None:
+            select.after(*after)
+        rows = select.limit(size + 1).exec()
+        if rows == -1:
+            log_db.error('Unable to sort the results of a search')
+            return [], None
+
+        results = []
+        for row in rows[:size]:
+            page = PageTable.select(ID=True, URI=True, title=True, date_created=True, last_edited=True, content=True)\
+                .where(ID=row[0]).exec()
+            if not page or page == -1:
+                continue
+            id, uri, title, content, date_created, last_edited = page[0]
+            results.append(SearchResult(id, uri, title, date_created, last_edited,
+                                        snippet=snippet_html(snippet(title, content)) if snippet else None))
+        return results, self._next_cursor(results, order, len(rows) > size)
+
+    @staticmethod
+    def _next_cursor(results, order, more):
+        """
+            :returns: the cursor of the page of results following
+                <results>, sorted on the ORDER BY terms <order>, or
+                None if there are no more.
+        """
+        if not more or not results:
+            return None
+        return encode_position([getattr(results[-1], term.split()[0].lower()) for term in order])
 
     def search(self, term, ignore_case=True, attrs=['title', 'tags', 'body']):
-        pages = self.index()
+        pages = self.index(with_content=True)
         regex = re.compile(term, re.IGNORECASE if ignore_case else 0)
         matched = []
         for page in pages:
@@ -0,0 +1,124 @@
+"""
+    Code highlighting cache
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    Pages embed the same code snippets again and again, and pygments
+    makes highlighting them most of the cost of rendering those pages.
+    The highlighted html of every code block is kept in a size bounded
+    LRU cache shared by the codehilite and fenced_code extensions.
+
+"""
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from markdown.extensions import codehilite
+from markdown.extensions import fenced_code
+
+import config
+
+log_wiki = logging.getLogger('wiki')
+
+
+class HighlightCache(object):
+    """
+        A thread safe LRU cache of highlighted code blocks, evicting the
+        least recently used blocks once their total size goes over a
+        number of bytes.
+    """
+
+    def __init__(self, max_bytes=None):
+        """
+            :param int max_bytes: the total size of the cached html,
+                defaults to HIGHLIGHT_CACHE_MAX_BYTES.
+        """
+        self.max_bytes = config.HIGHLIGHT_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            html = self._entries.get(key)
+            if html is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return html
+
+    def put(self, key, html):
+        size = len(html.encode(config.TEXT_ENCODING))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous.encode(config.TEXT_ENCODING))
+            self._entries[key] = html
+            self.size += size
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted.encode(config.TEXT_ENCODING))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self):
+        """
+            :returns: the hits, misses and evictions of the cache, and
+                the number and total size of the blocks it holds.
+            :rtype: dict
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes
+            }
+
+
+highlight_cache = HighlightCache()
+
+
+class CachedCodeHilite(codehilite.CodeHilite):
+    """
+        A CodeHilite that looks its output up in the highlight cache.
+        The key holds every option of the block, the language and line
+        numbers included, and a hash of its code.
+    """
+
+    def hilite(self):
+        options = tuple(sorted(
+            (name, tuple(value) if isinstance(value, list) else value)
+            for name, value in vars(self).items() if name != 'src'
+        ))
+        key = (options, hashlib.sha256(self.src.encode(config.TEXT_ENCODING)).digest())
+        html = highlight_cache.get(key)
+        if html is None:
+            html = super(CachedCodeHilite, self).hilite()
+            highlight_cache.put(key, html)
+        return html
+
+
+def install():
+    """
+        Makes the codehilite and fenced_code extensions highlight their
+        code blocks through the cache. Both create their CodeHilite from
+        the name in their module, so that name is replaced.
+    """
+    codehilite.CodeHilite = CachedCodeHilite
+    fenced_code.CodeHilite = CachedCodeHilite
+    log_wiki.debug('Code highlighting cache installed')
@@ -0,0 +1,429 @@
+"""
+    Regex search
+    ~~~~~~~~~~~~
+
+    Scans the pages for a regular expression across a pool of worker
+    processes. The pages are split into chunks of IDs which the workers
+    read from the database themselves, and the IDs of the matching
+    pages are handed back chunk by chunk as they are found.
+
+    Every query has a budget: a wall-clock deadline, shared by all its
+    chunks, and a CPU time limit per chunk. A worker that runs out of
+    either interrupts the regex, even in the middle of a match, and the
+    chunks of the query that have not started yet are skipped, so one
+    pathological pattern cannot pin the workers.
+
+    The literal text a match has to contain is extracted from the regex
+    and looked up in the trigram index of the pages first, so only the
+    pages holding it are scanned. Substring searches are narrowed down
+    the same way.
+
+    The results shown get a snippet of the passage that matched, cut
+    around the offsets of the first match with the matches marked.
+
+"""
+import logging
+import multiprocessing
+import re
+import signal
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+try:
+    import re._parser as sre_parse
+except ImportError:
+    import sre_parse
+
+from markupsafe import Markup
+from markupsafe import escape
+
+import config
+from wikiDB.tables import PageTable, PageTrigramSearchTable
+
+log = logging.getLogger('wiki')
+
+SPECIAL_CHARACTERS = "\"!@#\\$%^&*()-+?_=,<>/\""
+
+_REPEATS = {sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT, getattr(sre_parse, 'POSSESSIVE_REPEAT', None)}
+# Characters that match other characters when ignoring case which the trigram index does not fold to the same one:
+# Python matches 'i' with the dotted and dotless i, SQLite does not
+_CASE_UNSAFE = {'i', 'I'}
+
+# The marks around the matches of a snippet, the same the full-text search puts in PAGE_SEARCH.SNIPPET
+SNIPPET_START = '\x02'
+SNIPPET_END = '\x03'
+SNIPPET_ELLIPSIS = '…'
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+@lru_cache(maxsize=config.REGEX_CACHE_SIZE)
+def compile_pattern(pattern, flags=0):
+    """
+        Compiles a pattern, reusing the patterns compiled before.
+
+        :raises re.error: if the pattern is not a valid regex
+    """
+    return re.compile(pattern, flags)
+
+
+def searchable_content(content):
+    """
+        Decodes the content of a page for the regex scan, dropping the
+        quotes around content that was stored as a quoted string.
+    """
+    content = content.decode(config.TEXT_ENCODING) if isinstance(content, bytes) else content
+    if content and not content[0].isalnum() and not content[0] in SPECIAL_CHARACTERS:
+        content = content[1:-1]
+    return content
+
+
+def _phrase(text):
+    """
+        :returns: the trigram query matching the pages that hold every
+            trigram of <text>.
+    """
+    trigrams = list(OrderedDict.fromkeys(text[i:i + 3] for i in range(len(text) - 2)))
+    query = ' AND '.join('"%s"' % trigram.replace('"', '""') for trigram in trigrams)
+    return query if len(trigrams) == 1 else f'({query})'
+
+
+def _required(items, ignore_case):
+    """
+        Collects the trigram queries of the literal text a match of a
+        parsed regex has to contain: its runs of three literals or more,
+        the ones of the groups and repeats that have to match at least
+        once, and the ones common to every alternative.
+
+        :returns: the trigram queries, every one of which a match holds
+        :rtype: list
+    """
+    queries, run = [], []
+
+    def flush():
+        if len(run) >= 3:
+            queries.append(_phrase(''.join(run)))
+        run.clear()
+
+    for op, av in items:
+        if op is sre_parse.LITERAL and not (ignore_case and (av > 127 or chr(av) in _CASE_UNSAFE)):
+            run.append(chr(av))
+            continue
+        flush()
+        if op is sre_parse.SUBPATTERN:
+            group, add_flags, del_flags, pattern = av
+            queries += _required(pattern, (ignore_case or bool(add_flags & re.IGNORECASE))
+                                 and not del_flags & re.IGNORECASE)
+        elif op in _REPEATS and av[0] >= 1:
+            queries += _required(av[2], ignore_case)
+        elif op is getattr(sre_parse, 'ATOMIC_GROUP', None):
+            queries += _required(av, ignore_case)
+        elif op is sre_parse.BRANCH:
+            branches = [_required(branch, ignore_case) for branch in av[1]]
+            if all(branches):
+                queries.append('(%s)' % ' OR '.join(' AND '.join(branch) for branch in branches))
+    flush()
+    return queries
+
+
+def trigram_query(pattern, flags=0):
+    """
+        Builds the trigram query narrowing a regex search down to the
+        pages holding the literal text its matches contain.
+
+        :returns: the trigram query, or None if every page has to be
+            scanned.
+        :rtype: str
+    """
+    parsed = sre_parse.parse(pattern, flags)
+    queries = _required(parsed, bool(parsed.state.flags & re.IGNORECASE))
+    return ' AND '.join(queries) if queries else None
+
+
+def substring_query(words):
+    """
+        Builds the trigram query narrowing a substring search down to
+        the pages holding every one of <words>.
+
+        :returns: the trigram query, or None if every page has to be
+            scanned.
+        :rtype: str
+    """
+    queries = [_phrase(word) for word in words if len(word) >= 3]
+    return ' AND '.join(queries) if queries else None
+
+
+def _candidates(match, **columns):
+    """
+        :returns: the query over the pages a trigram query matches, or
+            over every page if there is none.
+    """
+    if match is None:
+        return PageTable.select(**columns)
+    return PageTrigramSearchTable.select(**columns).where(MATCHES=match)
+
+
+def like_regex(pattern):
+    """
+        Translates a LIKE pattern into a regex matching the same text
+        as SQLite does: '%' matches any text, '_' any character, and
+        only ASCII letters are compared without case.
+    """
+    regex = ''.join('.*' if c == '%' else '.' if c == '_' else re.escape(c) for c in pattern)
+    return re.compile(regex, re.IGNORECASE | re.ASCII | re.DOTALL)
+
+
+def substring_search(term, words):
+    """
+        The case-sensitive search of the search page: the pages whose
+        content holds every one of <words>, and whose content or title
+        matches the LIKE pattern <term>.
+
+        :returns: the IDs of the matching pages
+        :rtype: list
+    """
+    like = like_regex(term)
+    match = substring_query(words)
+    encoded = [word.encode(config.TEXT_ENCODING) for word in words]
+    ids = []
+    for id, title, content in _candidates(match, ID=True, title=True, content=True).stream():
+        if isinstance(content, str):
+            content = content.encode(config.TEXT_ENCODING)
+        if all(word in content for word in encoded) \
+                and (like.fullmatch(content.decode(config.TEXT_ENCODING, 'replace')) or like.fullmatch(title)):
+            ids.append(id)
+    log.debug(f'Substring search for \'{term}\' matched {len(ids)} pages'
+              f'{"" if match is None else " of the trigram candidates"}')
+    return ids
+
+
+def snippet(text, spans, context=None):
+    """
+        Cuts the passage of a text around its first match, marking the
+        matches it holds.
+
+        :param str text: the text that matched.
+        :param list spans: the (start, end) offsets of the matches, in
+            order.
+        :param int context: the number of characters kept on each
+            side of the first match, defaults to SEARCH_SNIPPET_CONTEXT.
+
+        :returns: the passage, with the matches between SNIPPET_START
+            and SNIPPET_END
+        :rtype: str
+    """
+    if context is None:
+        context = config.SEARCH_SNIPPET_CONTEXT
+    if not spans:
+        return text[:2 * context] + (SNIPPET_ELLIPSIS if len(text) > 2 * context else '')
+    first_start, first_end = spans[0]
+    start = max(first_start - context, 0)
+    end = min(min(first_end, first_start + context) + context, len(text))
+    parts = [SNIPPET_ELLIPSIS if start > 0 else '']
+    position = start
+    for span_start, span_end in spans:
+        if span_start >= end:
+            break
+        span_end = min(span_end, end)
+        if span_start < position or span_start == span_end:
+            continue
+        parts += [text[position:span_start], SNIPPET_START, text[span_start:span_end], SNIPPET_END]
+        position = span_end
+    parts.append(text[position:end])
+    if end < len(text):
+        parts.append(SNIPPET_ELLIPSIS)
+    return ''.join(parts)
+
+
+def snippet_html(marked):
+    """
+        Turns a snippet made by :func:`snippet` or by the full-text
+        search into html, the matches highlighted.
+    """
+    if marked is None:
+        return None
+    html = str(escape(marked))
+    return Markup(html.replace(SNIPPET_START, '<mark>').replace(SNIPPET_END, '</mark>'))
+
+
+def regex_snippet(regex, content, context=None):
+    """
+        Builds the snippet of the content of a page for a regex search.
+        Only the matches within the passage are looked for, so the cost
+        does not depend on the size of the page.
+    """
+    if context is None:
+        context = config.SEARCH_SNIPPET_CONTEXT
+    text = searchable_content(content)
+    first = regex.search(text)
+    if first is None:
+        return snippet(text, [], context)
+    spans = [first.span()]
+    end = min(first.end(), first.start() + context) + context
+    if first.end() < end:
+        spans += [match.span() for match in regex.finditer(text, first.end(), end)]
+    return snippet(text, spans, context)
+
+
+def substring_snippet(words, content, context=None):
+    """
+        Builds the snippet of the content of a page for a substring
+        search, marking the occurrences of <words>.
+    """
+    if context is None:
+        context = config.SEARCH_SNIPPET_CONTEXT
+    text = searchable_content(content)
+    words = [word for word in words if word]
+    found = [(text.find(word), word) for word in words]
+    found = [(position, word) for position, word in found if position != -1]
+    if not found:
+        return snippet(text, [], context)
+    first, word = min(found)
+    end = min(first + len(word), first + context) + context
+    spans = []
+    for word in words:
+        position = text.find(word, first)
+        while position != -1 and position < end:
+            spans.append((position, position + len(word)))
+            position = text.find(word, position + len(word))
+    return snippet(text, sorted(spans), context)
+
+
+def _exceeded(signum, frame):
+    raise BudgetExceeded()
+
+
+def _init_worker():
+    if hasattr(signal, 'setitimer'):
+        signal.signal(signal.SIGALRM, _exceeded)
+        signal.signal(signal.SIGPROF, _exceeded)
+
+
+def _arm(seconds, cpu_seconds):
+    if hasattr(signal, 'setitimer'):
+        signal.setitimer(signal.ITIMER_REAL, seconds)
+        signal.setitimer(signal.ITIMER_PROF, cpu_seconds)
+
+
+def _disarm():
+    if hasattr(signal, 'setitimer'):
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.setitimer(signal.ITIMER_PROF, 0)
+
+
+def _scan_chunk(task):
+    """
+        Scans a chunk of pages in a worker.
+
+        :param tuple task: the pattern and its flags, the trigram query
+            of the candidate pages, the ID the chunk starts after, the
+            number of pages in it, the deadline of the query and the CPU
+            time the chunk may use.
+
+        :returns: the IDs of the matching pages, and whether the whole
+            chunk was scanned.
+        :rtype: tuple
+    """
+    pattern, flags, match, after, count, deadline, cpu_budget = task
+    remaining = deadline - time.time()
+    if remaining <= 0:
+        return [], False
+    regex = compile_pattern(pattern, flags)
+    ids = []
+    try:
+        _arm(remaining, cpu_budget)
+        query = _candidates(match, ID=True, title=True, content=True).order_by("ID").after(after).limit(count)
+        for id, title, content in query.stream():
+            if regex.search(searchable_content(content)) or regex.search(title):
+                ids.append(id)
+            if not hasattr(signal, 'setitimer') and time.time() > deadline:
+                return ids, False
+        return ids, True
+    except BudgetExceeded:
+        return ids, False
+    finally:
+        _disarm()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """
+        Returns the worker pool of the regex search, starting it on
+        first use.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            context = multiprocessing.get_context('spawn')
+            _pool = context.Pool(config.REGEX_WORKERS, initializer=_init_worker)
+        return _pool
+
+
+class RegexScan(object):
+    """
+        A regex search over the title and content of the pages.
+        Iterating it yields the IDs of the matching pages as the chunks
+        holding them are scanned; afterwards, complete tells whether
+        every page was scanned within the budget.
+    """
+
+    def __init__(self, pattern, flags=0, time_budget=None, cpu_budget=None, chunk_size=None):
+        """
+            :param str pattern: the regex to search for.
+            :param int flags: the flags of the regex.
+            :param float time_budget: the seconds the whole query may
+                take, defaults to REGEX_TIME_BUDGET.
+            :param float cpu_budget: the CPU seconds a chunk may take,
+                defaults to REGEX_CPU_BUDGET.
+            :param int chunk_size: the number of pages per chunk,
+                defaults to REGEX_CHUNK_SIZE.
+
+            :raises re.error: if the pattern is not a valid regex
+        """
+        compile_pattern(pattern, flags)
+        self.pattern = pattern
+        self.flags = flags
+        self.match = trigram_query(pattern, flags)
+        self.time_budget = config.REGEX_TIME_BUDGET if time_budget is None else time_budget
+        self.cpu_budget = config.REGEX_CPU_BUDGET if cpu_budget is None else cpu_budget
+        self.chunk_size = config.REGEX_CHUNK_SIZE if chunk_size is None else chunk_size
+        self.complete = True
+
+    def _tasks(self, deadline):
+        rows = _candidates(self.match, ID=True).order_by("ID").exec()
+        if rows == -1:
+            log.error('Unable to list the pages to scan')
+            rows = []
+        ids = [row[0] for row in rows]
+        log.debug(f'Regex search for \'{self.pattern}\' scans {len(ids)} pages'
+                  f'{"" if self.match is None else " found through the trigram index"}')
+        tasks = []
+        for start in range(0, len(ids), self.chunk_size):
+            after = ids[start - 1] if start > 0 else -1
+            tasks.append((self.pattern, self.flags, self.match, after, self.chunk_size, deadline, self.cpu_budget))
+        return tasks
+
+    def __iter__(self):
+        start = time.time()
+        deadline = start + self.time_budget
+        tasks = self._tasks(deadline)
+        results = get_pool().imap_unordered(_scan_chunk, tasks)
+        for _ in tasks:
+            try:
+                ids, complete = results.next(timeout=max(deadline - time.time(), 0))
+            except multiprocessing.TimeoutError:
+                # the chunks still running stop at the deadline on their own
+                self.complete = False
+                break
+            self.complete = self.complete and complete
+            yield from ids
+        if not self.complete:
+            log.warning(f'Regex search for \'{self.pattern}\' stopped after {time.time() - start:.2f}s, '
+                        f'results are incomplete')
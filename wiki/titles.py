@@ -0,0 +1,203 @@
+"""
+    Title index
+    ~~~~~~~~~~~
+
+    The typeahead suggests pages as a title or url is typed, which has
+    to be answered without listing the pages. The titles and urls of
+    the pages are kept in memory in a sorted array, built from a
+    projection of PAGE on the first lookup and kept current by a change
+    listener, and a prefix is looked up by bisection. The listener only
+    hears of the changes made by this process, so the index is also
+    reloaded once it gets older than TYPEAHEAD_INDEX_TTL.
+
+"""
+import logging
+import threading
+import time
+from bisect import bisect_left
+from bisect import insort
+
+import config
+from wiki.core import add_listener
+from wiki.core import write_generation
+from wikiDB.tables import PageTable
+
+log_wiki = logging.getLogger('wiki')
+
+
+def fold(text):
+    """
+        :returns: the text as compared by the typeahead, without case.
+    """
+    return text.casefold()
+
+
+class TitleIndex(object):
+    """
+        A thread safe, sorted array of (key, url) pairs, where the keys
+        of a page are its case folded title and url, along with the
+        title of every url. The pages whose title or url starts with a
+        prefix are next to each other in the array, right where bisecting
+        it for the prefix lands.
+    """
+
+    def __init__(self, ttl=None):
+        """
+            :param float ttl: the seconds before the index is reloaded,
+                defaults to TYPEAHEAD_INDEX_TTL.
+        """
+        self.ttl = config.TYPEAHEAD_INDEX_TTL if ttl is None else ttl
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._keys = []
+        self._titles = {}
+        self._expires = 0
+        self.built = False
+        self.builds = 0
+        self.lookups = 0
+
+    @staticmethod
+    def _pairs(url, title):
+        return {(fold(title or ''), url), (fold(url), url)}
+
+    def build(self):
+        """
+            Loads the titles and urls of every page, replacing the
+            contents of the index.
+
+            :returns: False if the pages could not be loaded
+        """
+        rows = PageTable.select(URI=True, title=True).exec()
+        if rows == -1:
+            log_wiki.error('Unable to load the titles of the pages')
+            return False
+        titles = dict(rows)
+        keys = sorted(pair for url, title in titles.items() for pair in self._pairs(url, title))
+        with self._lock:
+            self._keys = keys
+            self._titles = titles
+            self.builds += 1
+        log_wiki.info(f'Title index built over {len(titles)} pages')
+        return True
+
+    def _current(self):
+        return self.built and time.monotonic() < self._expires
+
+    def _ensure_built(self):
+        """
+            Builds the index on first use, so that nothing touches the
+            database before it is set up, and reloads it once it has
+            expired. The changes made while it is loaded are missed by
+            the listener, so it is loaded again until none were. While
+            one request reloads an expired index, the others keep using
+            it.
+        """
+        if self._current():
+            return
+        if not self._build_lock.acquire(blocking=not self.built):
+            return
+        try:
+            while not self._current():
+                generation = write_generation()
+                if not self.build():
+                    return
+                if write_generation() == generation:
+                    self._expires = time.monotonic() + self.ttl
+                    self.built = True
+        finally:
+            self._build_lock.release()
+
+    def add(self, url, title):
+        with self._lock:
+            self._remove(url)
+            self._add(url, title)
+
+    def remove(self, url):
+        with self._lock:
+            self._remove(url)
+
+    def move(self, url, newurl):
+        with self._lock:
+            if url in self._titles:
+                title = self._remove(url)
+                self._remove(newurl)
+                self._add(newurl, title)
+
+    def _add(self, url, title):
+        self._titles[url] = title
+        for pair in self._pairs(url, title):
+            insort(self._keys, pair)
+
+    def _remove(self, url):
+        """
+            :returns: the title of the page removed, if it was there.
+        """
+        if url not in self._titles:
+            return None
+        title = self._titles.pop(url)
+        for pair in self._pairs(url, title):
+            index = bisect_left(self._keys, pair)
+            if index < len(self._keys) and self._keys[index] == pair:
+                del self._keys[index]
+        return title
+
+    def lookup(self, prefix, limit=None):
+        """
+            Finds the pages whose title or url starts with a prefix,
+            without case.
+
+            :param str prefix: the text typed so far.
+            :param int limit: the number of pages returned, defaults to
+                TYPEAHEAD_RESULTS.
+
+            :returns: the (title, url) of the pages, sorted on the title
+                or url that matched.
+            :rtype: list
+        """
+        if limit is None:
+            limit = config.TYPEAHEAD_RESULTS
+        prefix = fold(prefix)
+        found = []
+        if not prefix or limit <= 0:
+            return found
+        self._ensure_built()
+        seen = set()
+        with self._lock:
+            self.lookups += 1
+            index = bisect_left(self._keys, (prefix,))
+            while index < len(self._keys) and len(found) < limit:
+                key, url = self._keys[index]
+                if not key.startswith(prefix):
+                    break
+                if url not in seen:
+                    seen.add(url)
+                    found.append((self._titles[url], url))
+                index += 1
+        return found
+
+    def update(self, event, url, newurl=None, title=None, **details):
+        """
+            Change listener keeping the index current, once it is built.
+        """
+        if not self.built:
+            return
+        if event == 'save':
+            self.add(url, title)
+        elif event == 'move':
+            self.move(url, newurl)
+        elif event == 'delete':
+            self.remove(url)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'built': self.built,
+                'builds': self.builds,
+                'pages': len(self._titles),
+                'keys': len(self._keys),
+                'lookups': self.lookups
+            }
+
+
+title_index = TitleIndex()
+add_listener(title_index.update)
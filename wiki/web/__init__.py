@@ -48,6 +48,9 @@ def create_app(directory):
     from wiki.web.routes import bp
     app.register_blueprint(bp)
 
+    from wiki.web import assets
+    assets.init_app(app)
+
     return app
 
 
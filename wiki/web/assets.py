@@ -0,0 +1,146 @@
+"""
+    Static assets
+    ~~~~~~~~~~~~~
+
+    A build step copies the static assets into static/dist under names
+    holding a hash of their content, along with a gzipped copy of each
+    and a manifest. Templates reference them through asset_url, and as
+    a fingerprinted name changes with the file it can be cached by the
+    browser for good. Large text responses are gzipped on the fly.
+
+    Build the assets from the repository root with:
+
+        python -m wiki.web.assets
+
+"""
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import sys
+
+from flask import current_app
+from flask import request
+from flask import send_from_directory
+from flask import url_for
+
+import config
+
+log = logging.getLogger('wiki')
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+MANIFEST = 'manifest.json'
+
+
+def build(static_dir=STATIC_DIR, dist_dir=DIST_DIR):
+    """
+        Writes a fingerprinted and a gzipped copy of every static asset
+        into the dist directory, and the manifest mapping their names to
+        the fingerprinted ones.
+
+        :returns: the manifest
+        :rtype: dict
+    """
+    os.makedirs(dist_dir, exist_ok=True)
+    manifest = {}
+    for name in sorted(os.listdir(static_dir)):
+        path = os.path.join(static_dir, name)
+        if not os.path.isfile(path):
+            continue
+        with open(path, 'rb') as file:
+            data = file.read()
+        base, ext = os.path.splitext(name)
+        hashed = f'{base}.{hashlib.sha256(data).hexdigest()[:12]}{ext}'
+        with open(os.path.join(dist_dir, hashed), 'wb') as file:
+            file.write(data)
+        # mtime=0 keeps the gzipped copy identical from one build to the next
+        with open(os.path.join(dist_dir, hashed + '.gz'), 'wb') as file:
+            file.write(gzip.compress(data, compresslevel=9, mtime=0))
+        manifest[name] = hashed
+        log.info(f'Built asset \'{name}\' as \'{hashed}\'')
+    with open(os.path.join(dist_dir, MANIFEST), 'w') as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    return manifest
+
+
+def load_manifest(dist_dir=DIST_DIR):
+    """
+        :returns: the manifest of the built assets, empty if they were
+            not built.
+        :rtype: dict
+    """
+    try:
+        with open(os.path.join(dist_dir, MANIFEST), 'r') as file:
+            return json.load(file)
+    except (IOError, ValueError):
+        log.warning('Static assets are not built, serving them unversioned')
+        return {}
+
+
+def asset_url(filename):
+    """
+        Template global giving the url of a static asset: its
+        fingerprinted copy if the assets were built, the asset itself
+        otherwise.
+    """
+    hashed = current_app.extensions['assets'].get(filename)
+    if hashed is None:
+        return url_for('static', filename=filename)
+    return url_for('assets', filename=hashed)
+
+
+def serve_asset(filename):
+    """
+        Serves a fingerprinted asset, gzipped if the client accepts it,
+        with a far-future expiry.
+    """
+    gzipped = 'gzip' in request.accept_encodings and os.path.isfile(os.path.join(DIST_DIR, filename + '.gz'))
+    response = send_from_directory(DIST_DIR, filename + '.gz' if gzipped else filename,
+                                   mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+                                   cache_timeout=config.ASSET_MAX_AGE)
+    if gzipped:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = f'public, max-age={config.ASSET_MAX_AGE}, immutable'
+    return response
+
+
+def compress(response):
+    """
+        Gzips large text responses for the clients that accept it.
+    """
+    if response.status_code != 200 or response.direct_passthrough or 'Content-Encoding' in response.headers \
+            or response.mimetype not in config.GZIP_MIMETYPES or 'gzip' not in request.accept_encodings:
+        return response
+    data = response.get_data()
+    if len(data) < config.GZIP_MIN_SIZE:
+        return response
+    response.set_data(gzip.compress(data, compresslevel=config.GZIP_LEVEL))
+    response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        # The gzipped body is not byte for byte the one the strong ETag was given to
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_app(app):
+    """
+        Registers the assets route, the asset_url template global and
+        the compression of responses on an application.
+    """
+    app.extensions['assets'] = load_manifest()
+    app.add_url_rule('/assets/<path:filename>', 'assets', serve_asset)
+    app.add_template_global(asset_url)
+    app.after_request(compress)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    manifest = build()
+    print(f'Built {len(manifest)} assets into {DIST_DIR}')
+    sys.exit(0)
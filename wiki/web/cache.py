@@ -0,0 +1,262 @@
+"""
+    Page responses
+    ~~~~~~~~~~~~~~
+
+    Validators for conditional GETs of the pages, so a browser that
+    already has the current version of a page gets a 304 without the
+    page being loaded or rendered, an in-process cache of the page
+    responses served to anonymous visitors, and one of the results of
+    the recent searches.
+
+"""
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from flask import request
+from flask import session
+from flask_login import current_user
+
+import config
+from wiki.core import add_listener
+from wiki.core import write_generation
+
+log = logging.getLogger('wiki')
+
+
+def validators(version):
+    """
+        Builds the ETag and Last-Modified of a page. The ETag changes
+        with the page and with who is logged in, as the page template
+        does.
+
+        :param tuple version: the last edited date and content hash of
+            the page, see :meth:`Wiki.get_version`.
+
+        :returns: the ETag, and the Last-Modified date as naive UTC
+        :rtype: tuple
+    """
+    last_edited, key = version
+    user = current_user.get_id() if current_user.is_authenticated else ''
+    etag = hashlib.sha1(f'{last_edited}\n{key}\n{user}'.encode(config.TEXT_ENCODING)).hexdigest()
+    try:
+        # LAST_EDITED holds the local time of the server
+        last_modified = datetime.fromisoformat(str(last_edited)).astimezone(timezone.utc).replace(tzinfo=None)
+    except ValueError:
+        last_modified = None
+    return etag, last_modified
+
+
+def not_modified(etag):
+    """
+        :returns: True if the client already has the version of the
+            page with the given ETag. If-Modified-Since alone never
+            gets a 304: Last-Modified does not change with who is
+            logged in, and two saves within a second share it.
+    """
+    return request.if_none_match.contains_weak(etag)
+
+
+def conditional(response, etag, last_modified):
+    """
+        Adds the validators of a page to a response. Clients have to
+        revalidate before reusing it, as a page can change at any time.
+    """
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response
+
+
+def flashes_pending():
+    """
+        :returns: True if messages are waiting to be shown, in which
+            case the page has to be rendered to show them.
+    """
+    return bool(session.get('_flashes'))
+
+
+class ResponseCache(object):
+    """
+        A thread safe LRU of the rendered pages served to anonymous
+        visitors, by url. An entry is only used while its ETag is the
+        current one, and is dropped as soon as its page is saved, moved
+        or deleted.
+    """
+
+    def __init__(self, size=None):
+        """
+            :param int size: the number of pages kept, defaults to
+                RESPONSE_CACHE_SIZE. 0 disables the cache.
+        """
+        self.size = config.RESPONSE_CACHE_SIZE if size is None else size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def usable(self):
+        """
+            :returns: True if the current request may be answered from
+                the cache.
+        """
+        return self.size > 0 and not current_user.is_authenticated and not flashes_pending()
+
+    def get(self, url, etag):
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is None or entry[0] != etag:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(url)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, url, etag, body):
+        if self.size <= 0:
+            return
+        with self._lock:
+            self._entries[url] = (etag, body)
+            self._entries.move_to_end(url)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, event, url, newurl=None, **details):
+        """
+            Change listener dropping the pages a change affects.
+        """
+        with self._lock:
+            self._entries.pop(url, None)
+            if newurl is not None:
+                self._entries.pop(newurl, None)
+        log.debug(f'Response cache dropped \'{url}\' on {event}')
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+                'size': self.size
+            }
+
+
+response_cache = ResponseCache()
+add_listener(response_cache.invalidate)
+
+
+class SearchCache(object):
+    """
+        A thread safe LRU of the results of the recent searches: the
+        IDs of the pages a regex or substring search matched, by search
+        text and case flag, so the following pages of its results are
+        sorted and cut out of them without scanning the pages again, and
+        the pages of results of a full-text search, by search text, sort
+        option, cursor and page size, as only the results shown are
+        ever fetched from the full-text index.
+
+        Entries are only used while the write generation is the one
+        they were computed at, so all of them are dropped as soon as a
+        page is saved, moved or deleted, and expire after a while
+        anyway, which bounds how stale they get when other processes
+        change the pages.
+    """
+
+    def __init__(self, size=None, max_bytes=None, ttl=None):
+        """
+            :param int size: the number of searches kept, defaults to
+                SEARCH_CACHE_SIZE. 0 disables the cache.
+            :param int max_bytes: the total size of the results kept,
+                defaults to SEARCH_CACHE_MAX_BYTES.
+            :param float ttl: the seconds an entry is used for, defaults
+                to SEARCH_CACHE_TTL.
+        """
+        self.size = config.SEARCH_CACHE_SIZE if size is None else size
+        self.max_bytes = config.SEARCH_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self.ttl = config.SEARCH_CACHE_TTL if ttl is None else ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._generation = write_generation()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _sync(self):
+        """
+            Drops every entry once the pages have changed. Must be
+            called with the lock held.
+        """
+        generation = write_generation()
+        if generation != self._generation:
+            if self._entries:
+                self.invalidations += 1
+                log.debug(f'Search cache dropped {len(self._entries)} searches at write generation {generation}')
+            self._entries.clear()
+            self.bytes = 0
+            self._generation = generation
+
+    def get(self, key):
+        with self._lock:
+            self._sync()
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() > entry[0]:
+                if entry is not None:
+                    self._drop(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key, generation, value, nbytes):
+        """
+            Keeps the results of a search.
+
+            :param tuple key: what the search is looked up by.
+            :param int generation: the write generation read before
+                the search was run; results computed while a page was
+                changing are not kept.
+            :param value: what to keep
+            :param int nbytes: the size of the results.
+        """
+        nbytes += sum(len(str(part)) for part in key)
+        if self.size <= 0 or nbytes > self.max_bytes:
+            return
+        with self._lock:
+            self._sync()
+            if generation != self._generation:
+                return
+            self._drop(key)
+            self._entries[key] = (time.monotonic() + self.ttl, nbytes, value)
+            self.bytes += nbytes
+            while len(self._entries) > self.size or self.bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+
+    def stats(self):
+        with self._lock:
+            self._sync()
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else None,
+                'invalidations': self.invalidations,
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+                'size': self.size,
+                'max_bytes': self.max_bytes
+            }
+
+
+search_cache = SearchCache()
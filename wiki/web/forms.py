@@ -32,6 +32,10 @@ class URLForm(Form):
 
 
 class SearchForm(Form):
+    # submitted with GET, so result pages can be linked to and paginated
+    class Meta:
+        csrf = False
+
     term = TextField('', [InputRequired()])
     ignore_case = BooleanField(
         description='Ignore Case',
@@ -39,7 +43,8 @@ class SearchForm(Form):
         default=True)
     option = SelectField("Sort By", choices=[("default", "Relevance"), ("CDO", "Creation Date: Oldest"),
                                              ("CDN", "Creation Date: Newest"), ("EDO", "Last Edited Date: Oldest"),
-                                             ("EDN", "Last Edited Date: Newest")], render_kw={'style': 'width: 15ch'},)
+                                             ("EDN", "Last Edited Date: Newest")], render_kw={'style': 'width: 15ch'},
+                         default="default")
 
 
 
@@ -0,0 +1,215 @@
+"""
+    Incremental preview
+    ~~~~~~~~~~~~~~~~~~~
+
+    The editor asks for a preview of the whole page on every change.
+    The page is split into its top level blocks, the html of every block
+    is cached per editing session, and only the blocks that changed
+    since the last preview are rendered again. Joined back together the
+    blocks give the same html as a full render; the few constructs that
+    reach across blocks (reference links, raw html blocks) are rendered
+    in full instead.
+
+"""
+import hashlib
+import logging
+import re
+import threading
+import uuid
+from collections import OrderedDict
+
+from flask import session
+
+import config
+from wiki.core import Processor
+from wiki.core import markdown_pool
+
+log = logging.getLogger('wiki')
+
+# Extensions whose output for a block does not depend on the other blocks
+BLOCK_SAFE_EXTENSIONS = {'codehilite', 'fenced_code', 'meta', 'tables'}
+
+FENCE_REGEX = re.compile(
+    r'''^(?P<fence>~{3,}|`{3,})[ ]*(\{?\.?[\w#.+-]*)?[ ]*(hl_lines=(?P<quot>"|').*?(?P=quot))?[ ]*}?[ ]*$'''
+)
+INDENTED_REGEX = re.compile(r'^[ ]{4}')
+LIST_REGEX = re.compile(r'^[ ]{0,3}([*+-]|\d+\.)[ ]+')
+QUOTE_REGEX = re.compile(r'^[ ]{0,3}>')
+# Reference definitions apply to the whole page and raw html blocks can span blank lines
+FULL_RENDER_REGEX = re.compile(r'^[ ]{0,3}(\[[^\]]*\]:|<)')
+# A paragraph rendered after every group, as markdown strips the whitespace that separates the groups in a page
+BLOCK_END = 'wikipreviewblockend'
+
+
+def normalize(text):
+    """
+        Normalizes line endings, tabs and blank lines the way markdown
+        does before parsing blocks.
+    """
+    text = text.replace('\r\n', '\n').replace('\r', '\n').expandtabs(4)
+    return re.sub(r'(?<=\n) +\n', '\n', text)
+
+
+def _fence_end(lines, start):
+    """
+        :returns: the index of the line closing the fenced code block
+            opened at line <start>, or None if it is not a fenced
+            code block.
+    """
+    match = FENCE_REGEX.match(lines[start])
+    if match is None:
+        return None
+    fence = match.group('fence')
+    for i in range(start + 1, len(lines)):
+        if lines[i].rstrip(' ') == fence:
+            return i
+    return None
+
+
+def _kinds(chunk):
+    kinds = set()
+    for line in chunk:
+        if LIST_REGEX.match(line):
+            kinds.add('list')
+        if QUOTE_REGEX.match(line):
+            kinds.add('quote')
+    return kinds
+
+
+def split_blocks(text):
+    """
+        Splits a page into groups of blocks that render independently
+        of each other: the header, and then runs of lines separated by
+        blank lines, keeping fenced code blocks whole and joining
+        indented blocks, lists and block quotes to the group they
+        continue.
+
+        :param str text: the normalized text of the page.
+
+        :returns: the groups of blocks, the header first (it may be
+            empty), or None if the page has to be rendered in full.
+        :rtype: list
+    """
+    lines = text.split('\n')
+    chunks, chunk = [], []
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        end = _fence_end(lines, i)
+        if end is not None:
+            chunk.extend(lines[i:end + 1])
+            i = end + 1
+            continue
+        if line == '':
+            chunks.append(chunk)
+            chunk = []
+        elif FULL_RENDER_REGEX.match(line):
+            return None
+        else:
+            chunk.append(line)
+        i += 1
+    chunks.append(chunk)
+
+    # The header ends at the first blank line, even if the page starts with one. A list or block quote continues the
+    # last one of the group before it, so the group remembers whether any of its lines could have started one.
+    groups, kinds, blanks = [chunks[0]], set(), 0
+    for chunk in chunks[1:]:
+        # consecutive blank lines leave empty chunks, which have to be kept inside a group
+        blanks += 1
+        if not chunk:
+            continue
+        first = chunk[0]
+        if INDENTED_REGEX.match(first) \
+                or (LIST_REGEX.match(first) and 'list' in kinds) \
+                or (QUOTE_REGEX.match(first) and 'quote' in kinds):
+            groups[-1] = groups[-1] + [''] * blanks + chunk
+            kinds |= _kinds(chunk)
+        else:
+            groups.append(chunk)
+            kinds = _kinds(chunk)
+        blanks = 0
+    return ['\n'.join(group) for group in groups]
+
+
+def render_block(text, extensions):
+    """
+        Renders a group of blocks the way :meth:`Processor.process`
+        renders a page, keeping the whitespace that follows it.
+    """
+    with markdown_pool.converter(extensions) as md:
+        html = md.convert(f'{text}\n\n{BLOCK_END}')
+    html = html[:html.rindex(f'<p>{BLOCK_END}</p>')]
+    for processor in Processor.postprocessors:
+        html = processor(html)
+    return html
+
+
+class PreviewCache(object):
+    """
+        The rendered blocks of the last preview of the recent editing
+        sessions.
+    """
+
+    def __init__(self, max_sessions=None):
+        """
+            :param int max_sessions: the number of editing sessions
+                kept, defaults to PREVIEW_SESSIONS.
+        """
+        self.max_sessions = config.PREVIEW_SESSIONS if max_sessions is None else max_sessions
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()
+
+    def render(self, text, session_id):
+        """
+            Renders a page, reusing the blocks of the last preview of
+            the session that did not change. Only the blocks of this
+            preview are kept for the next one.
+
+            :param str text: the text of the page.
+            :param str session_id: the editing session.
+
+            :returns: the html of the page
+            :rtype: str
+        """
+        extensions = Processor.extensions
+        groups = split_blocks(normalize(text)) if BLOCK_SAFE_EXTENSIONS.issuperset(extensions) else None
+        if groups is None:
+            log.debug('Rendering the preview in full')
+            return Processor(text).process()[0]
+
+        with self._lock:
+            previous = self._sessions.pop(session_id, {})
+        body_extensions = [extension for extension in extensions if extension != 'meta']
+        blocks, html = {}, []
+        for i, group in enumerate(groups):
+            if not group:
+                continue
+            key = (i == 0, hashlib.sha1(group.encode(config.TEXT_ENCODING)).digest())
+            block = blocks.get(key)
+            if block is None:
+                block = previous.get(key)
+            if block is None:
+                block = render_block(group, extensions if i == 0 else body_extensions)
+            blocks[key] = block
+            html.append(block)
+        log.debug(f'Preview rendered {len(blocks) - len(blocks.keys() & previous.keys())} of {len(groups)} blocks')
+
+        with self._lock:
+            self._sessions[session_id] = blocks
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        return ''.join(html).strip()
+
+
+preview_cache = PreviewCache()
+
+
+def render_preview(text):
+    """
+        Renders the preview of a page for the editing session of the
+        current user.
+    """
+    session_id = session.get('preview')
+    if session_id is None:
+        session_id = session['preview'] = uuid.uuid4().hex
+    return preview_cache.render(text, session_id)
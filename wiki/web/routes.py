@@ -3,9 +3,12 @@
     ~~~~~~
 """
 import logging
+from array import array
 
 from flask import Blueprint
 from flask import flash
+from flask import jsonify
+from flask import make_response
 from flask import redirect
 from flask import render_template
 from flask import request
@@ -15,15 +18,33 @@ from flask_login import login_required
 from flask_login import login_user
 from flask_login import logout_user
 
-from wiki.core import Processor
+import config
+from wiki.core import is_plain_search
+from wiki.core import markdown_pool
+from wiki.core import write_generation
+from wiki.highlight import highlight_cache
+from wiki.titles import title_index
+from wiki.search import RegexScan
+from wiki.search import compile_pattern
+from wiki.search import regex_snippet
+from wiki.search import substring_search
+from wiki.search import substring_snippet
 from wiki.web.forms import EditorForm
 from wiki.web.forms import LoginForm
 from wiki.web.forms import SearchForm
 from wiki.web.forms import URLForm
+from wiki.web.cache import conditional
+from wiki.web.cache import flashes_pending
+from wiki.web.cache import not_modified
+from wiki.web.cache import response_cache
+from wiki.web.cache import search_cache
+from wiki.web.cache import validators
+from wiki.web.preview import render_preview
 from wiki.web import current_wiki
 from wiki.web import current_users
+from wiki.web.user import admin_required
 from wiki.web.user import protect
-from wikiDB.DatabaseModel import Page
+from wikiDB.stats import query_stats
 import re
 import doctest
 
@@ -44,15 +65,35 @@ def home():
 @bp.route('/index/')
 @protect
 def index():
-    pages = current_wiki.index()
-    return render_template('index.html', pages=pages)
+    pages, next_cursor = current_wiki.index_page(request.args.get('after'))
+    return render_template('index.html', pages=pages, next_cursor=next_cursor)
 
 
 @bp.route('/<path:url>/')
 @protect
 def display(url):
-    page = current_wiki.get_from_DB(url)
-    return render_template('page.html', page=page)
+    """
+    Displays a page. Clients sending the ETag of the current version of the page get a 304 without the page
+    being loaded or rendered, and anonymous visitors are served from the response cache.
+    @param url: the url of the page
+    @return: the page, or 304 Not Modified
+    """
+    version = None if flashes_pending() else current_wiki.get_version(url)
+    if version is None:
+        page = current_wiki.get_from_DB(url)
+        return render_template('page.html', page=page)
+
+    etag, last_modified = validators(version)
+    if not_modified(etag):
+        return conditional(make_response('', 304), etag, last_modified)
+    cacheable = response_cache.usable()
+    body = response_cache.get(url, etag) if cacheable else None
+    if body is None:
+        page = current_wiki.get_from_DB(url)
+        body = render_template('page.html', page=page)
+        if cacheable:
+            response_cache.put(url, etag, body)
+    return conditional(make_response(body), etag, last_modified)
 
 
 @bp.route('/create/', methods=['GET', 'POST'])
@@ -84,10 +125,7 @@ def edit(url):
 @bp.route('/preview/', methods=['POST'])
 @protect
 def preview():
-    data = {}
-    processor = Processor(request.form['body'])
-    data['html'], data['body'], data['meta'] = processor.process()
-    return data['html']
+    return render_preview(request.form['body'])
 
 
 @bp.route('/move/<path:url>/', methods=['GET', 'POST'])
@@ -127,15 +165,15 @@ def tags():
 @bp.route('/tag/<string:name>/')
 @protect
 def tag(name):
-    tagged = current_wiki.index_by_tag(name)
-    return render_template('tag.html', pages=tagged, tag=name)
+    tagged, next_cursor = current_wiki.index_page(request.args.get('after'), tag=name)
+    return render_template('tag.html', pages=tagged, tag=name, next_cursor=next_cursor)
 
 
 @bp.route('/categories/')
 @protect
 def categories():
-    tags = current_wiki.get_tags()
-    page = current_wiki.index()
+    page, next_cursor = current_wiki.index_page(request.args.get('after'), with_header=True)
+    tags = current_wiki.get_tags(page)
     pages = []
     for item in page:
         pageTags = (item.tags).split(',')
@@ -158,50 +196,80 @@ def categories():
     #           }
     #       }
     #   }
-    return render_template('categories.html', pages=pages, tags=tags)
+    return render_template('categories.html', pages=pages, tags=tags, next_cursor=next_cursor)
 
 
-@bp.route('/search/', methods=['GET', 'POST'])
+@bp.route('/search/')
 @protect
 def search():
     """
-    Defines a route to display the search page or the search
-    page with its results based on the search terms given by the user.
+    Defines a route to display the search page or, given a search term, a page of its results. Results come a page at
+    a time, ?size= of them after the cursor ?after=, and only the pages of the results shown are loaded. The pages a
+    regex or substring search matched, and the pages of results of a full-text search, are kept in the search cache.
     @return: Render template for search page
     """
-    form = SearchForm()
-    if form.validate_on_submit():
+    form = SearchForm(request.args if 'term' in request.args else None)
+    if 'term' in request.args and form.validate():
         searchText = form.term.data
         log.debug(f'Raw search text: \'{searchText}\'')
         caseInsensitive = form.ignore_case.data
         option = form.option.data
-
-        results = query_for_regex(option, searchText, caseInsensitive)
-        if not caseInsensitive:
-            if not results:
-                term = format_term(searchText)
-                words = term[1:-1].split('%')
-                idList = []
-                searchTerm = term.encode()
-                log.debug(f'Processed search text: \'{searchTerm}\'')
-                results = Page.query.filter(Page.content.like(searchTerm) | Page.title.like(searchTerm)).all()
-                for result in results:
-                    if all((word.encode() in result.content for word in words) or (word.encode() in result.title
-                           for word in words)):
-                        idList.append(result.id)
-                results = iterate_id_list(option, idList)
+        cursor = request.args.get('after')
+        size = max(min(request.args.get('size', config.SEARCH_PAGE_SIZE, type=int), config.SEARCH_MAX_PAGE_SIZE), 1)
+
+        # words, phrases and prefixes are answered by the full-text index, ranked by relevance
+        plain = caseInsensitive and is_plain_search(searchText)
+        mode, ids = ('text', None) if plain else find_matches(option, searchText, caseInsensitive)
+        if mode == 'text':
+            key = ('text', searchText, option, cursor, size)
+            found = search_cache.get(key)
+            if found is None:
+                generation = write_generation()
+                found = query_for_search(option, searchText, cursor, size)
+                search_cache.put(key, generation, found, results_size(found[0]))
+            results, next_cursor = found
         else:
-            if not results:
-                term = format_term(searchText)
-                searchTerm = term.encode()
-                log.debug(f'Processed search text: \'{searchTerm}\'')
-                results = query_for_search(option, searchTerm)
+            results, next_cursor = query_for_pages(mode, searchText, caseInsensitive, ids, option, cursor, size)
 
+        args = request.args.to_dict()
+        args.pop('after', None)
         return render_template('search.html', form=form, results=results, search=form.term.data,
-                               case=form.ignore_case.data)
+                               case=form.ignore_case.data,
+                               next_url=url_for('wiki.search', after=next_cursor, **args) if next_cursor else None,
+                               first_url=url_for('wiki.search', **args) if cursor else None)
     return render_template('search.html', form=form, search=None)
 
 
+@bp.route('/titles/')
+@protect
+def titles():
+    """
+    Suggests the pages whose title or url starts with ?prefix=, for the typeahead of page titles and links. Answered
+    from the in-memory title index, without touching the database.
+    @return: the title and url of up to ?limit= pages, as JSON
+    """
+    prefix = request.args.get('prefix', '')
+    limit = max(min(request.args.get('limit', config.TYPEAHEAD_RESULTS, type=int), config.TYPEAHEAD_MAX_RESULTS), 1)
+    return jsonify([{'title': title, 'url': url} for title, url in title_index.lookup(prefix, limit)])
+
+
+@bp.route('/admin/stats/')
+@admin_required
+def admin_stats():
+    """
+    Exposes the runtime statistics of the wiki as JSON, to the users listed in ADMIN_USERS only.
+    @return: the statistics of the database layer and the renderer
+    """
+    return jsonify({
+        'database': query_stats.snapshot(),
+        'markdown': markdown_pool.stats(),
+        'highlight': highlight_cache.stats(),
+        'responses': response_cache.stats(),
+        'search': search_cache.stats(),
+        'titles': title_index.stats()
+    })
+
+
 @bp.route('/user/login/', methods=['GET', 'POST'])
 def user_login():
     form = LoginForm()
@@ -256,65 +324,102 @@ def page_not_found(error):
     return render_template('404.html'), 404
 
 
-def query_for_search(option, search_term):
+def find_matches(option, searchText, caseInsensitive):
     """
-    Returns pages that match the term or terms that was given by the user.
+    Runs a search the full-text index cannot answer: as a regex, and for a case-sensitive search that matches nothing,
+    as substrings. The matching pages are kept in the search cache, so the following pages of results and repeated
+    searches do not run it again.
     @param option: sort by option for pages
-    @param search_term: term or terms given by the user to search
-    @return: a list of all the pages that matches the term or terms given
+    @param searchText: user's raw search text
+    @param caseInsensitive: a boolean that determines if the search is case-sensitive or not
+    @return: the kind of search that matched ('regex' or 'substring', or 'text' if the full-text index is to be tried
+    instead), and the IDs of the matching pages
     """
-    log.info(f'Searching for pages with criteria: \'{search_term}\', option: \'{option}\'')
+    key = ('matches', searchText, caseInsensitive)
+    found = search_cache.get(key)
+    if found is None:
+        generation = write_generation()
+        ids, complete = query_for_regex(option, searchText, caseInsensitive)
+        mode = 'regex'
+        if not ids:
+            if caseInsensitive:
+                mode = 'text'
+            else:
+                term = format_term(searchText)
+                words = term[1:-1].split('%')
+                log.debug(f'Processed search text: \'{term}\'')
+                mode, ids = 'substring', array('q', substring_search(term, words))
+        found = (mode, ids)
+        # a search stopped by its time budget is run again next time
+        if complete:
+            search_cache.put(key, generation, found, ids.itemsize * len(ids))
+    return found
+
+
+def query_for_pages(mode, searchText, caseInsensitive, ids, option, cursor=None, size=None):
+    """
+    Returns a page of the results of a regex or substring search, with the snippets of the passages that matched.
+    @param mode: the kind of search that matched, see find_matches
+    @param searchText: user's raw search text
+    @param caseInsensitive: a boolean that determines if the search is case-sensitive or not
+    @param ids: the IDs of the matching pages
+    @param option: sort by option for pages
+    @param cursor: the cursor of the page of results, None for the first one
+    @param size: the number of results per page
+    @return: the pages of the page of results, and the cursor of the next page
+    """
+    if mode == 'regex':
+        regex = compile_pattern(searchText, re.IGNORECASE if caseInsensitive else 0)
+        return current_wiki.search_pages(ids, option, cursor, size,
+                                         lambda title, content: regex_snippet(regex, content))
+    words = format_term(searchText)[1:-1].split('%')
+    return current_wiki.search_pages(ids, option, cursor, size,
+                                     lambda title, content: substring_snippet(words, content))
+
+
+def query_for_search(option, search_text, cursor=None, size=None):
+    """
+    Returns a page of the pages that match the term or terms that was given by the user, through the full-text index
+    of the titles, tags and bodies of the pages.
+    @param option: sort by option for pages. "default" ranks them by relevance
+    @param search_text: words, "quoted phrases" and prefixes (word*) given by the user to search
+    @param cursor: the cursor of the page of results, None for the first one
+    @param size: the number of results per page
+    @return: the pages of the page that match the term or terms given, and the cursor of the next page
+    """
+    log.info(f'Searching for pages with criteria: \'{search_text}\', option: \'{option}\'')
+    return current_wiki.search_text(search_text, option, cursor, size)
 
-    results = None
-    if option == "default":
-        results = Page.query.filter(Page.content.like(search_term) | Page.title.like(search_term)).all()
-    elif option == "CDO":
-        results = Page.query.filter(Page.content.like(search_term) | Page.title.like(search_term)) \
-            .order_by(Page.date_created).all()
-    elif option == "CDN":
-        results = Page.query.filter(Page.content.like(search_term) | Page.title.like(search_term)) \
-            .order_by(Page.date_created.desc()).all()
-    elif option == "EDO":
-        results = Page.query.filter(Page.content.like(search_term) | Page.title.like(search_term)) \
-            .order_by(Page.last_edited).all()
-    elif option == "EDN":
-        results = Page.query.filter(Page.content.like(search_term) | Page.title.like(search_term)) \
-            .order_by(Page.last_edited.desc()).all()
-    return results
+
+def results_size(results):
+    """
+    Returns the approximate size of a page of search results, as counted by the search cache
+    @param results: the search results
+    @return: the number of characters of their urls, titles and snippets
+    """
+    return sum(len(result.uri) + len(result.title) + len(result.snippet or '') for result in results)
 
 
 def query_for_regex(option, search_term, case_insensitive):
     """
-    Returns articles that match the regex that was given by the user.
+    Returns the articles that match the regex that was given by the user.
     @param option: sort by option for articles
     @param search_term: regex given by the user to search
     @param case_insensitive: a boolean that determines if the search is case-sensitive or not
-    @return: a list of all the articles that matches the regex given
+    @return: the IDs of the articles that match the regex given, and whether every article was searched
     """
     log.info(f'Searching for pages with criteria: \'{search_term}\', option: \'{option}\'')
 
-    regexIdList = []
-    queryResults = Page.query.all()
-    special_characters = "\"!@#\\$%^&*()-+?_=,<>/\""
-    if not case_insensitive:
-        for result in queryResults:
-            content = result.content.decode()
-            title = result.title
-            if not content[0].isalnum() and not content[0] in special_characters:
-                content = content[1:-1]
-            if re.search(search_term, content) or re.search(search_term, title):
-                regexIdList.append(result.id)
-    else:
-        for result in queryResults:
-            content = result.content.decode()
-            title = result.title
-            if not content[0].isalnum() and not content[0] in special_characters:
-                content = content[1:-1]
-            if re.search(search_term, content, re.IGNORECASE) or re.search(search_term, title, re.IGNORECASE):
-                regexIdList.append(result.id)
-
-    results = iterate_id_list(option, regexIdList)
-    return results
+    flags = re.IGNORECASE if case_insensitive else 0
+    try:
+        scan = RegexScan(search_term, flags)
+    except re.error as e:
+        log.info(f'Invalid regex \'{search_term}\': {e}')
+        return array('q'), True
+    regexIdList = array('q', scan)
+    if not scan.complete:
+        flash('The search took too long and was stopped, some results may be missing.', 'warning')
+    return regexIdList, scan.complete
 
 
 def format_term(searchText):
@@ -334,23 +439,3 @@ def format_term(searchText):
         for t in terms:
             term = term + t + '%'
     return term
-
-
-def iterate_id_list(option, id_list):
-    """
-    Returns the query results using the given id list and sort by option
-    @param option: sorting of the Pages
-    @param id_list: list of Pages' ids that need to be gotten
-    @return: query results
-    """
-    if option == "default":
-        results = Page.query.filter(Page.id.in_(id_list)).all()
-    elif option == "CDO":
-        results = Page.query.filter(Page.id.in_(id_list)).order_by(Page.date_created).all()
-    elif option == "CDN":
-        results = Page.query.filter(Page.id.in_(id_list)).order_by(Page.date_created.desc()).all()
-    elif option == "EDO":
-        results = Page.query.filter(Page.id.in_(id_list)).order_by(Page.last_edited).all()
-    elif option == "EDN":
-        results = Page.query.filter(Page.id.in_(id_list)).order_by(Page.last_edited.desc()).all()
-    return results
@@ -8,6 +8,7 @@ import binascii
 import hashlib
 from functools import wraps
 
+from flask import abort
 from flask import current_app
 from flask_login import current_user
 
@@ -35,11 +36,10 @@ class UserManager(object):
         # with open(self.file) as f:
         #     data = json.loads(f.read())
 
-        raw_query_data = UserTable.select().exec()
         data = {}
 
         # Convert tables data to the expected dictionary format
-        for uid, username, password, email, authenticated, active in raw_query_data:
+        for uid, username, password, email, authenticated, active in UserTable.select().stream():
             data[username] = {
                 'active': active,
                 'authentication_method': 'cleartext',
@@ -180,3 +180,19 @@ def protect(f):
         return f(*args, **kwargs)
 
     return wrapper
+
+
+def admin_required(f):
+    """
+        Only lets the users listed in ADMIN_USERS through: anonymous
+        visitors are sent to log in, and other users get a 403.
+    """
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        if not current_user.is_authenticated:
+            return current_app.login_manager.unauthorized()
+        if current_user.get_id() not in current_app.config.get('ADMIN_USERS', ()):
+            abort(403)
+        return f(*args, **kwargs)
+
+    return wrapper
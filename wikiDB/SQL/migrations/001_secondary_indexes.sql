@@ -0,0 +1,11 @@
+-- Secondary indexes for the hot access paths. Every index ends with (or implicitly carries) the row ID, so the
+-- lookups that only need IDs never touch the PAGE rows themselves.
+
+-- Wiki.exists looks a page up by title as well as by URI
+CREATE INDEX IF NOT EXISTS IX_PAGE_TITLE ON PAGE (TITLE);
+-- The creation and last edited date sort options of the search page
+CREATE INDEX IF NOT EXISTS IX_PAGE_DATE_CREATED ON PAGE (DATE_CREATED, ID);
+CREATE INDEX IF NOT EXISTS IX_PAGE_LAST_EDITED ON PAGE (LAST_EDITED, ID);
+-- Both directions of the PAGE_TAGS join
+CREATE INDEX IF NOT EXISTS IX_PAGE_TAGS_PAGE_ID ON PAGE_TAGS (PAGE_ID, TAG_ID);
+CREATE INDEX IF NOT EXISTS IX_PAGE_TAGS_TAG_ID ON PAGE_TAGS (TAG_ID, PAGE_ID);
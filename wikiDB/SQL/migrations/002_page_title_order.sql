@@ -0,0 +1,3 @@
+-- The page index, tag and category listings are ordered by title, case-insensitively, with the ID as a tie breaker
+-- so that every page has a unique position to continue from.
+CREATE INDEX IF NOT EXISTS IX_PAGE_TITLE_NOCASE ON PAGE (TITLE COLLATE NOCASE, ID);
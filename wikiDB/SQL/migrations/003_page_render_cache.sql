@@ -0,0 +1,6 @@
+-- The rendered form of a page (html, body and meta data, as JSON) is kept next to its content together with the key
+-- it was rendered under: a hash of the content and the renderer version (see wiki.core.render_key). A page view then
+-- costs a lookup instead of a Markdown render, and a render made from older content or by an older renderer simply
+-- stops matching.
+ALTER TABLE PAGE ADD COLUMN RENDER_KEY TEXT;
+ALTER TABLE PAGE ADD COLUMN RENDERED TEXT;
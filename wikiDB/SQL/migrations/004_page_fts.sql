@@ -0,0 +1,59 @@
+-- Full-text index of the pages for the search page. PAGE_TEXT cuts the content of a page into the fields that are
+-- indexed: the tags line of its meta data header, and its body after the first blank line. PAGE_FTS is kept in sync
+-- with PAGE by triggers, so every write path (saves, moves, bulk loads) updates it.
+CREATE VIEW IF NOT EXISTS PAGE_TEXT AS
+SELECT ID,
+       TITLE,
+       trim(CASE instr(TAGS, char(10)) WHEN 0 THEN TAGS ELSE substr(TAGS, 1, instr(TAGS, char(10)) - 1) END) AS TAGS,
+       BODY
+FROM (SELECT ID,
+             TITLE,
+             CASE TAGS_AT WHEN 0 THEN '' ELSE substr(HEADER, TAGS_AT + 5) END AS TAGS,
+             BODY
+      FROM (SELECT ID,
+                   TITLE,
+                   HEADER,
+                   instr(lower(char(10) || HEADER), char(10) || 'tags:') AS TAGS_AT,
+                   BODY
+            FROM (SELECT ID,
+                         TITLE,
+                         CASE SPLIT WHEN 0 THEN TEXT ELSE substr(TEXT, 1, SPLIT - 1) END AS HEADER,
+                         CASE SPLIT WHEN 0 THEN '' ELSE substr(TEXT, SPLIT + 2) END AS BODY
+                  FROM (SELECT ID, TITLE, CAST(CONTENT AS TEXT) AS TEXT, instr(CAST(CONTENT AS TEXT), char(10, 10)) AS SPLIT
+                        FROM PAGE))));
+
+-- prefix indexes make prefix queries ("wik*") as cheap as whole terms
+CREATE VIRTUAL TABLE IF NOT EXISTS PAGE_FTS USING fts5(TITLE, TAGS, BODY, tokenize = 'unicode61 remove_diacritics 2',
+                                                       prefix = '2 3');
+-- bm25 weights of the title, tags and body: a match in the title counts ten times one in the body
+INSERT INTO PAGE_FTS(PAGE_FTS, rank) VALUES ('rank', 'bm25(10.0, 5.0, 1.0)');
+
+INSERT INTO PAGE_FTS(rowid, TITLE, TAGS, BODY) SELECT ID, TITLE, TAGS, BODY FROM PAGE_TEXT;
+
+CREATE TRIGGER IF NOT EXISTS TR_PAGE_FTS_INSERT AFTER INSERT ON PAGE
+BEGIN
+    INSERT INTO PAGE_FTS(rowid, TITLE, TAGS, BODY) SELECT ID, TITLE, TAGS, BODY FROM PAGE_TEXT WHERE ID = NEW.ID;
+END;
+
+CREATE TRIGGER IF NOT EXISTS TR_PAGE_FTS_UPDATE AFTER UPDATE OF TITLE, CONTENT ON PAGE
+BEGIN
+    DELETE FROM PAGE_FTS WHERE rowid = OLD.ID;
+    INSERT INTO PAGE_FTS(rowid, TITLE, TAGS, BODY) SELECT ID, TITLE, TAGS, BODY FROM PAGE_TEXT WHERE ID = NEW.ID;
+END;
+
+CREATE TRIGGER IF NOT EXISTS TR_PAGE_FTS_DELETE AFTER DELETE ON PAGE
+BEGIN
+    DELETE FROM PAGE_FTS WHERE rowid = OLD.ID;
+END;
+
+-- The search results: querying MATCHES with '=' runs a full-text query, and RANK is its bm25 score (lower is better)
+CREATE VIEW IF NOT EXISTS PAGE_SEARCH AS
+SELECT PAGE.ID AS ID,
+       PAGE.URI AS URI,
+       PAGE.TITLE AS TITLE,
+       PAGE.DATE_CREATED AS DATE_CREATED,
+       PAGE.LAST_EDITED AS LAST_EDITED,
+       PAGE_FTS.PAGE_FTS AS MATCHES,
+       PAGE_FTS.rank AS RANK
+FROM PAGE_FTS
+         JOIN PAGE ON PAGE.ID = PAGE_FTS.rowid;
@@ -0,0 +1,36 @@
+-- Trigram index of the title and content of the pages, used to narrow substring and regex searches down to the pages
+-- holding every trigram of the text searched for, before the text itself is matched. Only which pages hold a trigram
+-- is needed, so the index keeps neither the text (content = '') nor the positions of the trigrams (detail = none).
+-- Trigrams are case folded, so the candidates of a case-sensitive search are a superset of its matches.
+CREATE VIRTUAL TABLE IF NOT EXISTS PAGE_TRIGRAM USING fts5(TITLE, CONTENT, tokenize = 'trigram', content = '',
+                                                           detail = none);
+
+INSERT INTO PAGE_TRIGRAM(rowid, TITLE, CONTENT) SELECT ID, TITLE, CAST(CONTENT AS TEXT) FROM PAGE;
+
+-- A contentless table can only forget a row given the values it was indexed with, which the triggers still have
+CREATE TRIGGER IF NOT EXISTS TR_PAGE_TRIGRAM_INSERT AFTER INSERT ON PAGE
+BEGIN
+    INSERT INTO PAGE_TRIGRAM(rowid, TITLE, CONTENT) VALUES (NEW.ID, NEW.TITLE, CAST(NEW.CONTENT AS TEXT));
+END;
+
+CREATE TRIGGER IF NOT EXISTS TR_PAGE_TRIGRAM_UPDATE AFTER UPDATE OF TITLE, CONTENT ON PAGE
+BEGIN
+    INSERT INTO PAGE_TRIGRAM(PAGE_TRIGRAM, rowid, TITLE, CONTENT)
+    VALUES ('delete', OLD.ID, OLD.TITLE, CAST(OLD.CONTENT AS TEXT));
+    INSERT INTO PAGE_TRIGRAM(rowid, TITLE, CONTENT) VALUES (NEW.ID, NEW.TITLE, CAST(NEW.CONTENT AS TEXT));
+END;
+
+CREATE TRIGGER IF NOT EXISTS TR_PAGE_TRIGRAM_DELETE AFTER DELETE ON PAGE
+BEGIN
+    INSERT INTO PAGE_TRIGRAM(PAGE_TRIGRAM, rowid, TITLE, CONTENT)
+    VALUES ('delete', OLD.ID, OLD.TITLE, CAST(OLD.CONTENT AS TEXT));
+END;
+
+-- The candidate pages of a search: querying MATCHES with '=' runs a trigram query such as '"abc" AND "bcd"'
+CREATE VIEW IF NOT EXISTS PAGE_TRIGRAM_SEARCH AS
+SELECT PAGE_TRIGRAM.rowid AS ID,
+       PAGE.TITLE AS TITLE,
+       PAGE.CONTENT AS CONTENT,
+       PAGE_TRIGRAM.PAGE_TRIGRAM AS MATCHES
+FROM PAGE_TRIGRAM
+         JOIN PAGE ON PAGE.ID = PAGE_TRIGRAM.rowid;
@@ -0,0 +1,17 @@
+-- Adds the highlighted snippet of a search result to PAGE_SEARCH. SNIPPET is the passage of about 16 tokens of the
+-- page that best matches the query, with the matched terms between char(2) and char(3) and '…' where it was cut.
+-- Like every column of a view it is only computed when selected, so it is fetched for the results shown only.
+-- ID now comes from PAGE_FTS, so a keyset on (RANK, ID) or a lookup by ID is answered by the full-text index itself.
+DROP VIEW IF EXISTS PAGE_SEARCH;
+
+CREATE VIEW PAGE_SEARCH AS
+SELECT PAGE_FTS.rowid AS ID,
+       PAGE.URI AS URI,
+       PAGE.TITLE AS TITLE,
+       PAGE.DATE_CREATED AS DATE_CREATED,
+       PAGE.LAST_EDITED AS LAST_EDITED,
+       PAGE_FTS.PAGE_FTS AS MATCHES,
+       PAGE_FTS.rank AS RANK,
+       snippet(PAGE_FTS, -1, char(2), char(3), '…', 16) AS SNIPPET
+FROM PAGE_FTS
+         JOIN PAGE ON PAGE.ID = PAGE_FTS.rowid;
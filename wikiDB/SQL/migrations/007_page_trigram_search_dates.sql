@@ -0,0 +1,13 @@
+-- Adds the dates of the pages to PAGE_TRIGRAM_SEARCH, so a regex or substring search reads the sort keys of the
+-- matching pages along with their text and sorts them itself, instead of seeking them in the index of the sort option.
+DROP VIEW IF EXISTS PAGE_TRIGRAM_SEARCH;
+
+CREATE VIEW PAGE_TRIGRAM_SEARCH AS
+SELECT PAGE_TRIGRAM.rowid AS ID,
+       PAGE.TITLE AS TITLE,
+       PAGE.CONTENT AS CONTENT,
+       PAGE.DATE_CREATED AS DATE_CREATED,
+       PAGE.LAST_EDITED AS LAST_EDITED,
+       PAGE_TRIGRAM.PAGE_TRIGRAM AS MATCHES
+FROM PAGE_TRIGRAM
+         JOIN PAGE ON PAGE.ID = PAGE_TRIGRAM.rowid;
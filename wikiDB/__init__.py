@@ -1,6 +1,6 @@
 import logging
 from sqlite3 import connect, Connection
-from os import getcwd
+from os import getcwd, listdir
 from os.path import exists
 
 import config
@@ -13,6 +13,48 @@ file_ext = ".db"
 def db_file_path():
     return getcwd() + "/" + db_name + file_ext
 
+def apply_pragmas(conn, pragmas=None):
+    """
+    Applies a pragma profile to a connection. journal_mode is persistent, so applying it also migrates the database
+    file itself.
+    @param conn: the connection to configure
+    @param pragmas: a dictionary of pragma names to values. Defaults to config.DB_PRAGMAS
+    """
+    if pragmas is None:
+        pragmas = config.DB_PRAGMAS
+    for name, value in pragmas.items():
+        result = conn.execute(f"PRAGMA {name} = {value};").fetchone()
+        if name == 'journal_mode' and result is not None and str(result[0]).upper() != str(value).upper():
+            log.warning(f'Unable to set journal_mode to \'{value}\', database is using \'{result[0]}\'')
+
+def migrate(conn):
+    """
+    Applies, in order, every script in SQL/migrations whose version is newer than the schema version recorded in the
+    database. Scripts are named '<version>_<description>.sql'; each one runs in its own transaction together with the
+    update of PRAGMA user_version, so a failed migration leaves the database at the previous version.
+    @param conn: a connection to the database to upgrade
+    @return: the schema version of the database
+    """
+    loc = __path__[0]
+    version = conn.execute("PRAGMA user_version;").fetchone()[0]
+    for name in sorted(listdir(f"{loc}/SQL/migrations")):
+        if not name.endswith(".sql"):
+            continue
+        target = int(name.split("_", 1)[0])
+        if target <= version:
+            continue
+        log.info(f'Migrating DB from schema version {version} to {target} ({name})')
+        with open(f"{loc}/SQL/migrations/{name}", "r") as file:
+            script = file.read()
+        try:
+            conn.executescript(f"BEGIN;\n{script}\nPRAGMA user_version = {target};\nCOMMIT;")
+        except Exception:
+            log.critical(f'Migration \'{name}\' failed, DB left at schema version {version}')
+            conn.rollback()
+            raise
+        version = target
+    return version
+
 def wiki_db_setup():
     loc = __path__[0]
     log.info("beginning db setup.")
@@ -22,6 +64,7 @@ def wiki_db_setup():
         if not isinstance(conn, Connection):
             log.critical("Unable to setup DB. ")
             raise TypeError
+        apply_pragmas(conn)
         log.info("Creating DB...")
         conn.executescript(query)
 
@@ -37,6 +80,8 @@ def wiki_db_setup():
                 datetime.now()
             )
         )
+        conn.commit()
+        migrate(conn)
 
 
 
@@ -44,9 +89,26 @@ def wiki_db_setup():
     log.info("Db created.")
 
 
+def wiki_db_upgrade():
+    """
+    Brings an existing database in line with the current configuration and schema: applies the pragma profile (which
+    migrates it to WAL journaling) and any pending migrations.
+    """
+    log.info("beginning db upgrade.")
+    conn = connect(db_file_path())
+    try:
+        apply_pragmas(conn)
+        version = migrate(conn)
+    finally:
+        conn.close()
+    log.info(f"Db upgraded to schema version {version}.")
+
+
 if __name__ == "__main__":
     if not exists(db_file_path()):
         wiki_db_setup()
+    else:
+        wiki_db_upgrade()
 
 
 
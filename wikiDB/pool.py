@@ -0,0 +1,182 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from queue import LifoQueue, Empty
+from sqlite3 import connect, OperationalError
+
+import config
+import wikiDB
+from wikiDB.stats import query_stats
+
+log = logging.getLogger('database')
+
+
+class ConnectionPool(object):
+    """
+    A bounded pool of SQLite connections.
+
+    A thread holds at most one connection at a time: nested calls to :meth:`connection` from the same thread are handed
+    the connection the thread already holds, and only the outermost call commits (or rolls back) and returns it to the
+    pool. Idle connections are reused most-recently-used first and are health checked before being handed out again.
+    """
+
+    def __init__(self, database, size=None, timeout=None, health_check_interval=None):
+        """
+        @param database: path of the SQLite database file
+        @param size: maximum number of connections open at once
+        @param timeout: seconds to wait for a free connection before giving up
+        @param health_check_interval: seconds a connection may sit idle before it is checked with 'SELECT 1'
+        """
+        self.database = database
+        self.size = config.DB_POOL_SIZE if size is None else size
+        self.timeout = config.DB_POOL_TIMEOUT if timeout is None else timeout
+        self.health_check_interval = config.DB_POOL_HEALTH_CHECK_INTERVAL \
+            if health_check_interval is None else health_check_interval
+        if self.size < 1:
+            raise ValueError("argument <size> must be a positive integer")
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = set()
+
+    def _open(self):
+        """
+        Opens a new connection and applies the per-connection pragmas once. Each connection keeps its own cache of
+        prepared statements, so repeated query templates are not parsed and planned again.
+        @return: the new connection
+        """
+        conn = connect(self.database, check_same_thread=False, cached_statements=config.DB_STATEMENT_CACHE_SIZE)
+        wikiDB.apply_pragmas(conn)
+        query_stats.connection_opened()
+        with self._lock:
+            self._connections.add(conn)
+        log.debug(f'Opened connection to \'{self.database}\' ({len(self._connections)}/{self.size})')
+        return conn
+
+    def _discard(self, conn):
+        with self._lock:
+            self._connections.discard(conn)
+        try:
+            conn.close()
+        except Exception:
+            log.warning(f'Failed to close a discarded connection to \'{self.database}\'')
+
+    @staticmethod
+    def _is_healthy(conn):
+        try:
+            conn.execute("SELECT 1;").fetchone()
+            return True
+        except Exception:
+            return False
+
+    def _checkout(self):
+        if os.getpid() != self._pid:
+            # Connections must not cross a fork; the child starts with an empty pool of its own
+            self._reset()
+        if not self._slots.acquire(timeout=self.timeout):
+            log.error(f'Timed out after {self.timeout}s waiting for a connection to \'{self.database}\'')
+            raise OperationalError("Timed out waiting for a database connection")
+        try:
+            while True:
+                try:
+                    conn, idle_since = self._idle.get_nowait()
+                except Empty:
+                    return self._open()
+                if time.monotonic() - idle_since < self.health_check_interval or self._is_healthy(conn):
+                    return conn
+                log.warning(f'Discarding unhealthy connection to \'{self.database}\'')
+                self._discard(conn)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _checkin(self, conn, healthy=True):
+        if healthy:
+            self._idle.put((conn, time.monotonic()))
+        else:
+            self._discard(conn)
+        self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """
+        Lends a connection to the calling thread for the duration of the with-block. The outermost block commits on
+        success and rolls back if an exception escapes it.
+        @return: a context manager yielding a sqlite3 connection
+        """
+        local = self._local
+        if getattr(local, 'depth', 0) > 0:
+            local.depth += 1
+            try:
+                yield local.conn
+            finally:
+                local.depth -= 1
+            return
+
+        conn = self._checkout()
+        local.conn, local.depth = conn, 1
+        healthy = True
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            try:
+                conn.rollback()
+            except Exception:
+                healthy = False
+            raise
+        finally:
+            local.conn, local.depth = None, 0
+            self._checkin(conn, healthy)
+
+    def close(self):
+        """
+        Closes every idle connection. Connections currently lent out are left alone.
+        """
+        while True:
+            try:
+                conn, idle_since = self._idle.get_nowait()
+            except Empty:
+                break
+            self._discard(conn)
+
+    @property
+    def open_connections(self):
+        return len(self._connections)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(database=None):
+    """
+    Returns the shared pool for a database, creating it on first use.
+    @param database: path of the database file. Defaults to the wiki database.
+    @return: a ConnectionPool
+    """
+    if database is None:
+        database = wikiDB.db_file_path()
+    pool = _pools.get(database)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(database)
+            if pool is None:
+                pool = _pools[database] = ConnectionPool(database)
+    return pool
+
+
+def close_all():
+    """
+    Closes the idle connections of every pool.
+    """
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
@@ -0,0 +1,166 @@
+import logging
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from datetime import datetime
+
+import config
+
+log = logging.getLogger('database')
+
+_WHITESPACE = re.compile(r"\s+")
+_PARAMETER_LIST = re.compile(r"\(\s*\?(\s*,\s*\?)*\s*\)")
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"(?<![\w.])-?\d+(\.\d+)?\b")
+
+
+def normalize(query_format):
+    """
+    Reduces a statement to its shape so that every execution of the same query is counted together: whitespace is
+    collapsed, literals are replaced by '?' and lists of parameters by '(...)'.
+    @param query_format: the SQL text of the statement
+    @return: the normalized SQL text
+    """
+    query_format = _STRING_LITERAL.sub("?", query_format)
+    query_format = _NUMBER_LITERAL.sub("?", query_format)
+    query_format = _PARAMETER_LIST.sub("(...)", query_format)
+    return _WHITESPACE.sub(" ", query_format).strip()
+
+
+class QueryStats(object):
+    """
+    Collects timings of the statements run through wikiDB.tables: a latency histogram per normalized statement, a log
+    of the slow statements (optionally with their query plan) and counters for rows returned and connections opened.
+    """
+
+    # upper bounds, in milliseconds, of the latency histogram buckets. The last bucket is unbounded.
+    BUCKETS = (0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+    def __init__(self, slow_query_ms=None, explain_slow_queries=None, slow_query_log_size=None):
+        """
+        @param slow_query_ms: the latency above which a statement is logged as slow
+        @param explain_slow_queries: capture EXPLAIN QUERY PLAN for slow statements
+        @param slow_query_log_size: the number of slow statements kept
+        """
+        self.slow_query_ms = config.DB_SLOW_QUERY_MS if slow_query_ms is None else slow_query_ms
+        self.explain_slow_queries = config.DB_EXPLAIN_SLOW_QUERIES \
+            if explain_slow_queries is None else explain_slow_queries
+        self._lock = threading.Lock()
+        self._slow_queries = deque(maxlen=config.DB_SLOW_QUERY_LOG_SIZE
+                                   if slow_query_log_size is None else slow_query_log_size)
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._statements = {}
+            self._slow_queries.clear()
+            self.statements_executed = 0
+            self.rows_returned = 0
+            self.connections_opened = 0
+            self.started = datetime.now()
+
+    def connection_opened(self):
+        with self._lock:
+            self.connections_opened += 1
+
+    def record(self, query_format, seconds, rows, conn=None, arguments=()):
+        """
+        Records one execution of a statement.
+        @param query_format: the SQL text of the statement
+        @param seconds: how long the statement took
+        @param rows: the number of rows it returned or changed
+        @param conn: the connection it ran on, used to capture the plan of a slow statement
+        @param arguments: the arguments it was bound with, used to capture the plan of a slow statement
+        """
+        key = normalize(query_format)
+        ms = seconds * 1000
+        with self._lock:
+            entry = self._statements.get(key)
+            if entry is None:
+                entry = self._statements[key] = {
+                    'count': 0,
+                    'total_ms': 0.0,
+                    'max_ms': 0.0,
+                    'rows': 0,
+                    'buckets': [0] * (len(self.BUCKETS) + 1)
+                }
+            entry['count'] += 1
+            entry['total_ms'] += ms
+            entry['max_ms'] = max(entry['max_ms'], ms)
+            entry['rows'] += max(rows, 0)
+            entry['buckets'][bisect_left(self.BUCKETS, ms)] += 1
+            self.statements_executed += 1
+            self.rows_returned += max(rows, 0)
+
+        if ms >= self.slow_query_ms:
+            plan = None
+            if self.explain_slow_queries and conn is not None:
+                plan = self._explain(conn, query_format, arguments)
+            log.warning(f'Slow query ({ms:.1f}ms, {rows} rows): {key}' + (f' | plan: {plan}' if plan else ''))
+            with self._lock:
+                self._slow_queries.append({
+                    'sql': key,
+                    'ms': round(ms, 3),
+                    'rows': rows,
+                    'plan': plan,
+                    'at': datetime.now().isoformat()
+                })
+
+    @staticmethod
+    def _explain(conn, query_format, arguments):
+        try:
+            return [row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {query_format}", arguments)]
+        except Exception:
+            log.debug(f'Unable to capture the plan of: {query_format}')
+            return None
+
+    def snapshot(self):
+        """
+        @return: a JSON serializable copy of the collected statistics, the slowest statements first
+        """
+        with self._lock:
+            statements = []
+            for key, entry in self._statements.items():
+                statements.append({
+                    'sql': key,
+                    'count': entry['count'],
+                    'rows': entry['rows'],
+                    'total_ms': round(entry['total_ms'], 3),
+                    'mean_ms': round(entry['total_ms'] / entry['count'], 3),
+                    'max_ms': round(entry['max_ms'], 3),
+                    'histogram': {
+                        (f'<={bound}ms' if i < len(self.BUCKETS) else f'>{self.BUCKETS[-1]}ms'): count
+                        for i, (bound, count) in enumerate(zip(self.BUCKETS + (None,), entry['buckets']))
+                    }
+                })
+            return {
+                'since': self.started.isoformat(),
+                'statements_executed': self.statements_executed,
+                'rows_returned': self.rows_returned,
+                'connections_opened': self.connections_opened,
+                'slow_query_ms': self.slow_query_ms,
+                'statements': sorted(statements, key=lambda x: x['total_ms'], reverse=True),
+                'slow_queries': list(self._slow_queries)
+            }
+
+
+class Timer(object):
+    """
+    Accumulates the time spent inside its with-blocks.
+    """
+
+    def __init__(self):
+        self.seconds = 0.0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds += time.perf_counter() - self._start
+        return False
+
+
+query_stats = QueryStats()
@@ -1,19 +1,23 @@
 
 # region Imports
+import json
 import logging
+import re
 import traceback
+from functools import lru_cache
 
 import config
 import wikiDB
-from sqlite3 import connect
 from sqlite3 import DatabaseError
+from wikiDB.pool import get_pool
+from wikiDB.stats import query_stats, Timer
 from abc import ABC, abstractmethod
 # endregion
 log = logging.getLogger('database')
 
 def _query(method):
     """
-    A decorator responsible for connecting to a SQLite database and returning the tables result (if any).
+    A decorator responsible for running a query on a pooled SQLite connection and returning the tables result (if any).
     @param method: the method to be decorated
     @return: the wrapper responsible for connecting to the database
     """
@@ -24,39 +28,125 @@ def _query(method):
         @return:
         """
         result = -1
-        conn = connect(wikiDB.db_file_path(), timeout=20)
         try:
-            cursor = conn.cursor()
             query_format, arguments = method(ref)
             log.debug(f'Attempting tables: {query_format}')
-            cursor.execute("PRAGMA foreign_keys = ON;")
-            cursor.execute(query_format, arguments)
-            result = cursor.fetchall()
-            conn.commit()
+            with get_pool().connection() as conn:
+                with Timer() as timer:
+                    cursor = conn.execute(query_format, arguments)
+                    result = cursor.fetchall()
+                query_stats.record(query_format, timer.seconds, len(result) or max(cursor.rowcount, 0),
+                                   conn, arguments)
         except Exception as e:
             log.error(traceback.format_exc())
-        finally:
-            conn.close()
         return result
 
     return query_wrap
 
-def _kwargs_sq_processor(kwargs):
+def _execute_many(queries, chunk_size=None):
     """
-    Converts all values within a provided dictionary to string values
-    @param kwargs:
-    @return:
+    Runs a stream of queries in a single transaction. Consecutive queries sharing the same SQL text are sent to
+    executemany together, at most <chunk_size> at a time, so generators are never fully materialized.
+    @param queries: an iterable of Query objects
+    @param chunk_size: the maximum number of rows handed to a single executemany call
+    @return: the number of rows affected, or -1 if the transaction was rolled back
     """
-    if not isinstance(kwargs, dict):
-        raise TypeError
-
-    for k in kwargs.keys():
-        if isinstance(kwargs[k], str):
-            kwargs[k] = f'\'{kwargs[k]}\''
-        else:
-            kwargs[k] = f'{kwargs[k]}'
-
-    return kwargs
+    if chunk_size is None:
+        chunk_size = config.DB_BULK_CHUNK_SIZE
+    if chunk_size < 1:
+        raise ValueError("argument <chunk_size> must be a positive integer")
+
+    count = 0
+    try:
+        with get_pool().connection() as conn:
+            batch_format, batch = None, []
+            def flush():
+                with Timer() as timer:
+                    rowcount = conn.executemany(batch_format, batch).rowcount
+                query_stats.record(batch_format, timer.seconds, rowcount, conn, batch[0])
+                return rowcount
+
+            for query in queries:
+                query_format, arguments = query.compile()
+                if batch and (query_format != batch_format or len(batch) >= chunk_size):
+                    count += flush()
+                    batch = []
+                batch_format = query_format
+                batch.append(arguments)
+            if batch:
+                log.debug(f'Attempting tables: {batch_format}')
+                count += flush()
+    except Exception as e:
+        log.error(traceback.format_exc())
+        return -1
+    return count
+
+_ORDER_TERM = re.compile(r"^\s*(?P<key>.+?)(\s+COLLATE\s+(?P<collation>\w+))?(\s+(?P<direction>ASC|DESC))?\s*$",
+                         re.IGNORECASE)
+
+@lru_cache(maxsize=config.DB_QUERY_TEMPLATE_CACHE_SIZE)
+def _compile(table, query_type, columns, fields, conflict, separator, where_keys, in_key, seek, group_by, order_by,
+             limit):
+    """
+    Builds the SQL text for a query of a given shape. Values are always bound as '?' parameters, so the text only
+    depends on the shape and can be cached.
+    @param table: name of the table to query
+    @param query_type: the type of query
+    @param columns: the columns selected by a SELECT
+    @param fields: the columns written by an INSERT or UPDATE
+    @param conflict: for an upsert, a tuple of the conflict target followed by the columns to update
+    @param separator: the separator between the conditions of the WHERE clause
+    @param where_keys: the columns compared in the WHERE clause
+    @param in_key: the column restricted to a set of values (see Query.where_in)
+    @param seek: whether the WHERE clause continues after a keyset (see Query.after)
+    @param group_by: the columns of the GROUP BY clause
+    @param order_by: the terms of the ORDER BY clause
+    @param limit: whether the query has a LIMIT
+    @return: the SQL text
+    """
+    seperator = ", "
+    clauses = []
+    if query_type == "INSERT":
+        clauses.append(f"INSERT INTO {table} ({seperator.join(fields)}) VALUES ({seperator.join(['?' for x in fields])})")
+        if conflict:
+            target, updates = conflict[0], conflict[1:]
+            if updates:
+                clauses.append(f"ON CONFLICT({target}) DO UPDATE SET "
+                               f"{seperator.join([f'{key}=excluded.{key}' for key in updates])}")
+            else:
+                clauses.append(f"ON CONFLICT({target}) DO NOTHING")
+    elif query_type == "SELECT":
+        clauses.append(f"SELECT {seperator.join(columns) if columns else '*'} FROM {table}")
+    elif query_type == "UPDATE":
+        clauses.append(f"UPDATE {table} SET {seperator.join([f'{key}=?' for key in fields])}")
+    elif query_type == "DELETE":
+        clauses.append(f"DELETE FROM {table}")
+
+    conditions = []
+    if where_keys:
+        condition = (' %s ' % separator).join([f'{key}=?' for key in where_keys])
+        conditions.append(f"({condition})" if (seek or in_key) and len(where_keys) > 1 else condition)
+    if in_key:
+        conditions.append(f"{in_key} IN (SELECT value FROM json_each(?))")
+    if seek:
+        # A row value comparison against the sort key of the last row seen. Collations go on the placeholders, so
+        # SQLite can still answer it with a seek into an index declared with the same collation.
+        keys, values = [], []
+        for term in order_by:
+            term = _ORDER_TERM.match(term)
+            keys.append(term.group('key'))
+            values.append(f"? COLLATE {term.group('collation')}" if term.group('collation') else "?")
+        operator = "<" if (_ORDER_TERM.match(order_by[0]).group('direction') or "").upper() == "DESC" else ">"
+        conditions.append(f"({seperator.join(keys)}) {operator} ({seperator.join(values)})")
+    if conditions:
+        clauses.append(f"WHERE {' AND '.join(conditions)}")
+    if group_by:
+        clauses.append(f"GROUP BY {seperator.join(group_by)}")
+    if order_by:
+        clauses.append(f"ORDER BY {seperator.join(order_by)}")
+    if limit:
+        clauses.append("LIMIT ?")
+    return f"{' '.join(clauses)};"
 
 class AbstractTable(ABC):
     class Query:
@@ -85,35 +175,52 @@ class AbstractTable(ABC):
             query_type = query_type.upper()
 
             if query_type not in self.query_types:
-                log.error()
+                log.error(f'Unsupported query type: \'{query_type}\'')
                 raise ValueError("argument <query_type> must be an element of ['INSERT','SELECT','UPDATE','DELETE']")
 
-            self._clauses = []
+            self._table = table
+            self._query_type = query_type
+            self._columns = ()
+            self._fields = ()
+            self._conflict = ()
             self._args = []
-            query_cmd = ""
+            self._separator = 'OR'
+            self._where_keys = ()
+            self._where_args = []
+            self._in_key = None
+            self._in_args = []
+            self._seek_args = []
+            self._group_by = ()
+            self._order_by = ()
+            self._limit_args = []
             if query_type == "INSERT":
                 if len(kwargs) == 0:
                     log.debug("'No fields for the INSERT statement were provided'")
                     raise ValueError
-                seperator = ", "
-                query_cmd = f"INSERT INTO {table} ({seperator.join(kwargs.keys())}) VALUES ({seperator.join(['?' for x in range(len(kwargs.values()))])})"
+                self._fields = tuple(kwargs.keys())
                 self._args = list(kwargs.values())
             elif query_type == "SELECT":
-                if len(args) == 0:
-                    query_cmd = f"SELECT * FROM {table}"
-                else:
-                    query_cmd = f"SELECT {', '.join(args)} FROM {table}"
+                self._columns = tuple(args)
             elif query_type == "UPDATE":
-                query_cmd = f"UPDATE {table} SET {', '.join([f'{key}=?' for key, value in kwargs.items()])}"
+                self._fields = tuple(kwargs.keys())
                 self._args = list(kwargs.values())
-            elif query_type == "DELETE":
-                query_cmd = f"DELETE FROM {table}"
 
-            self._clauses.append(query_cmd)
+        def on_conflict(self, target, *cols):
+            """
+            Turns an INSERT into an upsert: when the row collides with an existing one on <target>, the existing row is
+            updated in the same statement instead.
+            @param target: the unique column that detects the conflict
+            @param cols: the columns to overwrite with the inserted values. If none are given the insert is skipped
+            @return:
+            """
+            if self._query_type != "INSERT":
+                raise ValueError("ON CONFLICT can only be applied to an INSERT")
+            self._conflict = (target,) + cols
+            return self
 
         def where(self, separator='OR', **kwargs):
             """
-            Appends a where clause to the query
+            Appends a where clause to the query. The values are bound as parameters, never inlined into the SQL.
             @param separator: used for where statements with more than one condition. Defaults to OR
             @param kwargs: the conditions for the where clause
             @return:
@@ -121,9 +228,21 @@ class AbstractTable(ABC):
             if len(kwargs) == 0:
                 log.debug("'No conditions for the WHERE statement were provided'")
                 raise ValueError("No conditions for the WHERE statement were provided")
-            separator = " %s " % separator
-            kwargs = _kwargs_sq_processor(kwargs)
-            self._clauses.append(f"WHERE {separator.join([f'{key}={value}' for key, value in kwargs.items()])}")
+            self._separator = separator
+            self._where_keys = tuple(kwargs.keys())
+            self._where_args = list(kwargs.values())
+            return self
+
+        def where_in(self, key, values):
+            """
+            Only keeps the rows whose <key> is one of <values>, on top of the conditions of where(). The values are bound
+            as a single JSON array parameter, so the SQL text is the same however many there are.
+            @param key: the column to restrict
+            @param values: the values it may take, numbers or strings
+            @return:
+            """
+            self._in_key = key
+            self._in_args = [json.dumps(list(values))]
             return self
 
         def group_by(self, *cols):
@@ -132,19 +251,106 @@ class AbstractTable(ABC):
             @param cols: A string, or a list of strings, corresponding to the column names of a table
             @return:
             """
-            separator = ", "
-            self._clauses.append(f"GROUP BY {separator.join(cols)}")
+            self._group_by = tuple(cols)
             return self
 
+        def order_by(self, *cols):
+            """
+            Appends an ORDER BY clause to the query
+            @param cols: the terms to sort on, e.g. "TITLE COLLATE NOCASE" or "LAST_EDITED DESC"
+            @return:
+            """
+            self._order_by = tuple(cols)
+            return self
+
+        def limit(self, count):
+            """
+            Appends a LIMIT clause to the query
+            @param count: the maximum number of rows to return
+            @return:
+            """
+            if not isinstance(count, int) or count < 0:
+                raise ValueError("argument <count> must be a non-negative integer")
+            self._limit_args = [count]
+            return self
+
+        def after(self, *values):
+            """
+            Keyset pagination: only returns the rows that sort after the row whose ORDER BY terms had the given values.
+            Unlike an OFFSET, the cost of fetching a page does not grow with how far into the results it is.
+            @param values: the values of the ORDER BY terms of the last row of the previous page, in order
+            @return:
+            """
+            if len(self._order_by) == 0:
+                raise ValueError("A keyset can only follow an ORDER BY")
+            if len(values) != len(self._order_by):
+                raise ValueError("A value must be provided for every ORDER BY term")
+            directions = {(_ORDER_TERM.match(term).group('direction') or "ASC").upper() for term in self._order_by}
+            if len(directions) > 1:
+                raise ValueError("A keyset requires every ORDER BY term to sort in the same direction")
+            self._seek_args = list(values)
+            return self
+
+        def compile(self):
+            """
+            Assembles the final query without executing it
+            @return: a tuple of the SQL text and the arguments to bind to it
+            """
+            query_format = _compile(self._table, self._query_type, self._columns, self._fields, self._conflict,
+                                    self._separator, self._where_keys, self._in_key, len(self._seek_args) > 0,
+                                    self._group_by, self._order_by, len(self._limit_args) > 0)
+            return query_format, \
+                self._args + self._where_args + self._in_args + self._seek_args + self._limit_args
+
         @_query
         def exec(self):
             """
             Assembles the final query and executes it
             @return:
             """
-            log.debug(self._clauses)
-            log.debug(self._args)
-            return (f"{' '.join(self._clauses)};", self._args)
+            query_format, arguments = self.compile()
+            log.debug(arguments)
+            return query_format, arguments
+
+        def stream(self, batch_size=None):
+            """
+            Executes the query and yields its rows lazily, fetching <batch_size> rows at a time. The pooled connection
+            is only held while the rows are being iterated.
+            @param batch_size: the number of rows fetched per round trip. Defaults to config.DB_STREAM_BATCH_SIZE
+            @return: a generator over the resulting rows
+            """
+            if batch_size is None:
+                batch_size = config.DB_STREAM_BATCH_SIZE
+            query_format, arguments = self.compile()
+            log.debug(f'Attempting tables: {query_format}')
+            log.debug(arguments)
+            try:
+                with get_pool().connection() as conn:
+                    # Only the time spent in SQLite is recorded, not the time spent by the caller between batches
+                    timer, count = Timer(), 0
+                    with timer:
+                        cursor = conn.execute(query_format, arguments)
+                    try:
+                        with timer:
+                            rows = cursor.fetchmany(batch_size)
+                        while rows:
+                            count += len(rows)
+                            yield from rows
+                            with timer:
+                                rows = cursor.fetchmany(batch_size)
+                    finally:
+                        cursor.close()
+                        query_stats.record(query_format, timer.seconds, count, conn, arguments)
+            except Exception as e:
+                log.error(traceback.format_exc())
+                raise
+
+        @staticmethod
+        def template_cache_info():
+            """
+            @return: hit/miss statistics of the compiled query template cache
+            """
+            return _compile.cache_info()
 
     @classmethod
     @abstractmethod
@@ -176,6 +382,38 @@ class AbstractTable(ABC):
     def delete(cls):
         pass
 
+    @classmethod
+    def insert_many(cls, rows, chunk_size=None):
+        """
+        Inserts many rows in a single transaction.
+        @param rows: an iterable (or generator) of rows. Each row is either a tuple of the positional arguments or a
+        dictionary of the keyword arguments the table's insert() takes
+        @param chunk_size: the number of rows written per executemany call. Defaults to config.DB_BULK_CHUNK_SIZE
+        @return: the number of rows inserted, or -1 if nothing was inserted because of an error
+        """
+        return _execute_many(
+            (cls.insert(**row) if isinstance(row, dict) else cls.insert(*row) for row in rows),
+            chunk_size
+        )
+
+    @classmethod
+    def update_many(cls, rows, key="ID", chunk_size=None):
+        """
+        Updates many rows in a single transaction.
+        @param rows: an iterable (or generator) of dictionaries, each holding the value of the <key> column that
+        identifies the row and the new values of the columns to update
+        @param key: the column identifying the row to update. Defaults to ID
+        @param chunk_size: the number of rows written per executemany call. Defaults to config.DB_BULK_CHUNK_SIZE
+        @return: the number of rows updated, or -1 if nothing was updated because of an error
+        """
+        def queries():
+            for row in rows:
+                row = dict(row)
+                value = row.pop(key)
+                yield cls.Query(cls.name(), "UPDATE", **row).where(**{key: value})
+
+        return _execute_many(queries(), chunk_size)
+
 # region User Table
 class UserTable(AbstractTable):
 
@@ -229,16 +467,21 @@ class UserTable(AbstractTable):
 # region Page Table
 class PageTable(AbstractTable):
 
+    # The meta data block of a page, i.e. its content up to the first blank line, cut out by SQLite so listings
+    # that only need the title and tags do not fetch whole pages.
+    HEADER = "CASE instr(CONTENT, X'0A0A') WHEN 0 THEN CONTENT ELSE substr(CONTENT, 1, instr(CONTENT, X'0A0A') - 1) END"
+
     @classmethod
     def name(cls):
         return "PAGE"
 
     @classmethod
     def fields(cls):
-        return ["ID", "URI", "TITLE", "CONTENT", "DATE_CREATED", "LAST_EDITED"]
+        return ["ID", "URI", "TITLE", "CONTENT", "DATE_CREATED", "LAST_EDITED", "RENDER_KEY", "RENDERED"]
 
     @classmethod
-    def select(cls, ID=False, URI=False, title=False, content=False, date_created=False, last_edited=False):
+    def select(cls, ID=False, URI=False, title=False, content=False, date_created=False, last_edited=False,
+               render_key=False, rendered=False, header=False):
         args = []
         if ID:
             args.append("ID")
@@ -252,16 +495,33 @@ class PageTable(AbstractTable):
             args.append("DATE_CREATED")
         if last_edited:
             args.append("LAST_EDITED")
+        if render_key:
+            args.append("RENDER_KEY")
+        if rendered:
+            args.append("RENDERED")
+        if header:
+            args.append(cls.HEADER)
         return cls.Query(cls.name(), "SELECT", *args)
 
     @classmethod
-    def insert(cls, URI, title, content, date_created, last_edited):
+    def insert(cls, URI, title, content, date_created, last_edited, render_key=None, rendered=None):
         return cls.Query(cls.name(), "INSERT",
                          URI=URI,
                          title=title,
                          content=content,
                          date_created=date_created,
-                         last_edited=last_edited)
+                         last_edited=last_edited,
+                         render_key=render_key,
+                         rendered=rendered)
+
+    @classmethod
+    def upsert(cls, URI, title, content, date_created, last_edited, render_key=None, rendered=None):
+        """
+        Inserts a page, or updates the title, content, last edited date and cached render of the page already at
+        <URI>, in a single statement.
+        """
+        return cls.insert(URI, title, content, date_created, last_edited, render_key, rendered)\
+            .on_conflict("URI", "title", "content", "last_edited", "render_key", "rendered")
 
     @classmethod
     def update(cls, **kwargs):
@@ -272,6 +532,97 @@ class PageTable(AbstractTable):
         return cls.Query(cls.name(), "DELETE")
 # endregion
 
+# region Page Search View
+class PageSearchTable(AbstractTable):
+    """
+    The full-text search over the title, tags and body of the pages (see migrations 004 and 006). Only SELECT is
+    supported, the index is maintained by triggers on PAGE.
+    """
+
+    @classmethod
+    def name(cls):
+        return "PAGE_SEARCH"
+
+    @classmethod
+    def fields(cls):
+        return ["ID", "URI", "TITLE", "DATE_CREATED", "LAST_EDITED", "MATCHES", "RANK", "SNIPPET"]
+
+    @classmethod
+    def select(cls, ID=False, URI=False, title=False, date_created=False, last_edited=False, rank=False,
+               snippet=False):
+        args = []
+        if ID:
+            args.append("ID")
+        if URI:
+            args.append("URI")
+        if title:
+            args.append("TITLE")
+        if date_created:
+            args.append("DATE_CREATED")
+        if last_edited:
+            args.append("LAST_EDITED")
+        if rank:
+            args.append("RANK")
+        if snippet:
+            args.append("SNIPPET")
+        return cls.Query(cls.name(), "SELECT", *args)
+
+    @classmethod
+    def insert(cls, *args, **kwargs):
+        raise NotImplementedError("PAGE_SEARCH is maintained by triggers on PAGE")
+
+    @classmethod
+    def update(cls, **kwargs):
+        raise NotImplementedError("PAGE_SEARCH is maintained by triggers on PAGE")
+
+    @classmethod
+    def delete(cls):
+        raise NotImplementedError("PAGE_SEARCH is maintained by triggers on PAGE")
+# endregion
+
+# region Page Trigram Search View
+class PageTrigramSearchTable(AbstractTable):
+    """
+    The candidate pages of a substring or regex search, found through the trigram index of their title and content (see
+    migration 005). Only SELECT is supported, the index is maintained by triggers on PAGE.
+    """
+
+    @classmethod
+    def name(cls):
+        return "PAGE_TRIGRAM_SEARCH"
+
+    @classmethod
+    def fields(cls):
+        return ["ID", "TITLE", "CONTENT", "DATE_CREATED", "LAST_EDITED", "MATCHES"]
+
+    @classmethod
+    def select(cls, ID=False, title=False, content=False, date_created=False, last_edited=False):
+        args = []
+        if ID:
+            args.append("ID")
+        if title:
+            args.append("TITLE")
+        if content:
+            args.append("CONTENT")
+        if date_created:
+            args.append("DATE_CREATED")
+        if last_edited:
+            args.append("LAST_EDITED")
+        return cls.Query(cls.name(), "SELECT", *args)
+
+    @classmethod
+    def insert(cls, *args, **kwargs):
+        raise NotImplementedError("PAGE_TRIGRAM_SEARCH is maintained by triggers on PAGE")
+
+    @classmethod
+    def update(cls, **kwargs):
+        raise NotImplementedError("PAGE_TRIGRAM_SEARCH is maintained by triggers on PAGE")
+
+    @classmethod
+    def delete(cls):
+        raise NotImplementedError("PAGE_TRIGRAM_SEARCH is maintained by triggers on PAGE")
+# endregion
+
 # region Tag Table
 class TagTable(AbstractTable):
 